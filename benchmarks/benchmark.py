@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+API load test: generates a database (see generate.py) in a temporary directory, serves it
+with gunicorn like deploy/etc/systemd/system/gunicorn.service does and measures
+throughput and latency of the API calls made by the scanner client and the web
+frontend.
+"""
+
+import argparse
+import concurrent.futures
+import configparser
+import datetime
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import requests
+
+from generate import (END_DATE, PASSWORD, REPO_DIR, account_code, account_name, drink_barcode,
+                      generate)
+
+SUPERUSER_PASSWORD = 'benchmark'
+START_TIMEOUT = 30
+
+def create_config(path, database):
+    """Writes config.sample with the given database to "path"."""
+    config = configparser.ConfigParser()
+    config.read(os.path.join(REPO_DIR, 'config.sample'))
+    config.set('DEFAULT', 'database', database)
+    config.set('DEFAULT', 'superuser-password', SUPERUSER_PASSWORD)
+    with open(path, 'w') as config_file:
+        config.write(config_file)
+
+def free_port():
+    """Returns a TCP port that is currently unused."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(config, port, workers, threads):
+    """Starts gunicorn serving wsgi.py, returns the process once it accepts connections."""
+    env = dict(os.environ, CONFIG=config)
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--bind', '127.0.0.1:{}'.format(port),
+         '--workers', str(workers), '--threads', str(threads), 'wsgi'],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.time() + START_TIMEOUT
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError('gunicorn exited with {}'.format(proc.returncode))
+            time.sleep(0.1)
+
+    proc.kill()
+    raise RuntimeError('gunicorn did not start within {}s'.format(START_TIMEOUT))
+
+def scenarios(accounts, drink_barcodes):
+    """
+    Returns dict of scenario name -> (endpoint, function returning the POST
+    data of a random request).
+    """
+    return {
+        'payment_perform': ('/api/payment/perform', lambda: {
+            'superuserpassword': SUPERUSER_PASSWORD,
+            'account_code': account_code(random.randrange(accounts)),
+            'drink_barcode': random.choice(drink_barcodes),
+        }),
+        'code_exists': ('/api/account/code_exists', lambda: {
+            # every other code is unknown
+            'code': account_code(random.randrange(2 * accounts)),
+        }),
+        'money_view': ('/api/money/view', lambda: {
+            'name': account_name(random.randrange(accounts)),
+            'password': PASSWORD,
+            'limit': 50,
+        }),
+    }
+
+def percentile(latencies, percent):
+    """Returns the nearest-rank percentile of the sorted, non-empty latencies."""
+    return latencies[max(0, math.ceil(len(latencies) * percent / 100) - 1)]
+
+def run_scenario(api_url, endpoint, make_data, requests_total, concurrency):
+    """
+    POSTs "requests_total" requests to the endpoint from "concurrency"
+    threads, each with its own keep-alive session. Returns result dict.
+    """
+    def worker(count):
+        session = requests.Session()
+        latencies = []
+        errors = 0
+        for _ in range(count):
+            data = make_data()
+            start = time.perf_counter()
+            try:
+                req = session.post('{}{}'.format(api_url, endpoint), data=data)
+                ok = req.status_code == 200
+            except requests.exceptions.RequestException:
+                ok = False
+            latency = time.perf_counter() - start
+            if ok:
+                latencies.append(latency)
+            else:
+                errors += 1
+        session.close()
+        return latencies, errors
+
+    counts = [requests_total // concurrency + (index < requests_total % concurrency)
+              for index in range(concurrency)]
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(worker, counts))
+    duration = time.perf_counter() - start
+
+    latencies = sorted(latency for worker_latencies, _ in results
+                       for latency in worker_latencies)
+    return {
+        'requests': requests_total,
+        'errors': sum(errors for _, errors in results),
+        'duration_s': duration,
+        'throughput_rps': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 50) * 1000 if latencies else None,
+        'p95_ms': percentile(latencies, 95) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 99) * 1000 if latencies else None,
+    }
+
+def compare(baseline, results):
+    """Prints the relative change of every metric compared to baseline results."""
+    for name, result in results['scenarios'].items():
+        old = baseline['scenarios'].get(name)
+        if old is None:
+            continue
+        for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            if not old[metric] or result[metric] is None:
+                continue
+            change = (result[metric] - old[metric]) / old[metric] * 100
+            print('{:16} {:15} {:10.2f} -> {:10.2f} ({:+.1f}%)'.format(
+                name, metric, old[metric], result[metric], change), file=sys.stderr)
+
+def main():
+    """Run the benchmark and print the results as JSON"""
+    parser = argparse.ArgumentParser(description='Benchmark the Prepaid Mate API')
+    parser.add_argument('--accounts', type=int, default=5000)
+    parser.add_argument('--pay-logs', type=int, default=1000000)
+    parser.add_argument('--drinks', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0, help='seed of the generated data')
+    parser.add_argument('--end-date', type=datetime.date.fromisoformat, default=END_DATE,
+                        help='last day of the generated data, YYYY-MM-DD')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=1, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--scenario', action='append', choices=sorted(scenarios(1, [''])),
+                        help='scenario to run (default: all), can be repeated')
+    parser.add_argument('--output', help='write results to this file instead of stdout')
+    parser.add_argument('--compare', help='results file of a previous run to compare with')
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database = os.path.join(tmp_dir, 'db.sqlite')
+        config = os.path.join(tmp_dir, 'config')
+
+        start = time.perf_counter()
+        generate(database, args.accounts, args.pay_logs, args.drinks, seed=args.seed,
+                 end_date=args.end_date)
+        setup_duration = time.perf_counter() - start
+        create_config(config, database)
+
+        port = free_port()
+        proc = start_server(config, port, args.workers, args.threads)
+        try:
+            results = {'parameters': dict(vars(args), end_date=args.end_date.isoformat()),
+                       'setup_duration_s': setup_duration,
+                       'scenarios': {}}
+            drink_barcodes = [drink_barcode(index) for index in range(args.drinks)]
+            for name, (endpoint, make_data) in scenarios(args.accounts,
+                                                         drink_barcodes).items():
+                if args.scenario and name not in args.scenario:
+                    continue
+                results['scenarios'][name] = run_scenario(
+                    'http://127.0.0.1:{}'.format(port), endpoint, make_data, args.requests,
+                    args.concurrency)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            compare(json.load(baseline_file), results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Generates a reproducible, production-sized Prepaid Mate database: a few heavy
+users, a handful of popular drinks, sales peaking in the evening and top-ups
+spread over the years.
+"""
+
+import argparse
+import datetime
+import itertools
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import time
+
+from werkzeug.security import generate_password_hash
+
+from prepaid_mate.migrate import migrate
+
+REPO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+PASSWORD = 'benchmark'
+SECONDS_PER_DAY = 24 * 60 * 60
+# last day of the generated data, fixed so that a seed always gives the same database
+END_DATE = datetime.date(2024, 12, 31)
+PRICES = (100, 150, 200, 250)
+TOP_UPS = (500, 1000, 2000, 5000)
+# relative sales per hour of the day, peaking in the evening
+HOUR_WEIGHTS = (2, 1, 1, 0, 0, 0, 0, 1, 2, 3, 4, 5, 6, 6, 5, 5, 6, 8, 10, 12, 12, 10, 7, 4)
+# relative sales per weekday (Monday first)
+WEEKDAY_WEIGHTS = (8, 9, 12, 9, 10, 6, 4)
+
+def account_code(index):
+    """Returns the code of the generated account with the given index."""
+    return str(1000000000 + index)
+
+def account_name(index):
+    """Returns the name of the generated account with the given index."""
+    return 'account{}'.format(index)
+
+def drink_barcode(index):
+    """Returns the barcode of the generated drink with the given index."""
+    return str(4000000000000 + index)
+
+def pay_log_rows(rng, accounts, drinks, pay_logs, first_day, days):
+    """
+    Generator yielding pay_logs rows (account_id, drink_id, price, timestamp)
+    in chronological order. Account activity follows a Pareto distribution,
+    drink popularity Zipf's law.
+    """
+    account_weights = list(itertools.accumulate(rng.paretovariate(1.16)
+                                                for _ in range(accounts)))
+    drink_weights = list(itertools.accumulate(1 / rank for rank in range(1, drinks + 1)))
+    prices = [PRICES[index % len(PRICES)] for index in range(drinks)]
+    hour_weights = list(itertools.accumulate(HOUR_WEIGHTS))
+    # slowly growing popularity over the years
+    day_weights = list(itertools.accumulate(
+        WEEKDAY_WEIGHTS[(first_day + day + 3) % 7] * (1 + day / days) for day in range(days)))
+
+    sold = 0
+    for day in range(days):
+        count = round(pay_logs * day_weights[day] / day_weights[-1]) - sold
+        sold += count
+        day_start = (first_day + day) * SECONDS_PER_DAY
+        timestamps = sorted(day_start + hour * 3600 + rng.randrange(3600)
+                            for hour in rng.choices(range(24), cum_weights=hour_weights,
+                                                    k=count))
+        account_ids = rng.choices(range(1, accounts + 1), cum_weights=account_weights, k=count)
+        drink_ids = rng.choices(range(1, drinks + 1), cum_weights=drink_weights, k=count)
+        for timestamp, account_id, drink_id in zip(timestamps, account_ids, drink_ids):
+            yield (account_id, drink_id, prices[drink_id - 1], timestamp)
+
+def money_log_rows(rng, accounts, spent, first_day, days, min_balance):
+    """
+    Returns (money_logs rows (account_id, amount, timestamp) in chronological
+    order, dict of account_id -> saldo). Every account tops up at least what
+    it spent according to the "spent" dict plus "min_balance".
+    """
+    rows = []
+    saldos = {}
+    for account_id in range(1, accounts + 1):
+        total = 0
+        while total < spent.get(account_id, 0) + min_balance:
+            top_up = rng.choice(TOP_UPS)
+            total += top_up
+            timestamp = (first_day + rng.randrange(days)) * SECONDS_PER_DAY \
+                + rng.randrange(SECONDS_PER_DAY)
+            rows.append((account_id, top_up, timestamp))
+        saldos[account_id] = total - spent.get(account_id, 0)
+
+    rows.sort(key=lambda row: row[2])
+    return (rows, saldos)
+
+def build_rollups(database):
+    """Computes the daily sales rollups from pay_logs."""
+    database.execute(
+        '''INSERT INTO drink_sales_daily (day, drink_id, count, amount)
+           SELECT timestamp / 86400, drink_id, count(*), sum(price) FROM pay_logs
+           GROUP BY timestamp / 86400, drink_id''')
+    database.execute(
+        '''INSERT INTO account_sales_daily (day, account_id, count, amount)
+           SELECT timestamp / 86400, account_id, count(*), sum(price) FROM pay_logs
+           GROUP BY timestamp / 86400, account_id''')
+
+def generate(path, accounts=5000, pay_logs=1000000, drinks=30, years=5, seed=0,
+             min_balance=10000, end_date=END_DATE):
+    """
+    Creates a migrated database at "path" filled with generated data ending
+    on "end_date" (UTC). All rows are written with executemany() in a single
+    transaction. The same parameters always produce the same data.
+    """
+    rng = random.Random(seed)
+    days = years * 365
+    first_day = (end_date - datetime.date(1970, 1, 1)).days - days + 1
+
+    shutil.copyfile(os.path.join(REPO_DIR, 'db.sqlite'), path)
+    database = sqlite3.connect(path)
+    migrate(database)
+    # throwaway data, no need to survive a crash
+    database.execute('PRAGMA journal_mode=off')
+    database.execute('PRAGMA synchronous=off')
+
+    database.execute('BEGIN')
+    for table in ('drink_sales_daily', 'account_sales_daily', 'ledger', 'ledger_marks',
+                  'pay_logs', 'money_logs', 'accounts', 'drink_prices', 'drinks'):
+        database.execute('DELETE FROM {}'.format(table))
+
+    database.executemany(
+        'INSERT INTO drinks (id, name, content_ml, price, barcode) VALUES (?, ?, 500, ?, ?)',
+        ((index + 1, 'drink{}'.format(index), PRICES[index % len(PRICES)],
+          drink_barcode(index)) for index in range(drinks)))
+    database.execute('INSERT INTO drink_prices (drink_id, price, timestamp) '
+                     'SELECT id, price, ? FROM drinks', [first_day * SECONDS_PER_DAY])
+
+    # one hash for all, hashing thousands of passwords would take minutes
+    password_hash = generate_password_hash(PASSWORD)
+    database.executemany(
+        'INSERT INTO accounts (id, name, password_hash, barcode, saldo) VALUES (?, ?, ?, ?, 0)',
+        ((index + 1, account_name(index), password_hash, account_code(index))
+         for index in range(accounts)))
+
+    # building the indexes once afterwards is much faster than updating them per row
+    indexes = database.execute(
+        '''SELECT name, sql FROM sqlite_master WHERE type='index' AND sql IS NOT NULL
+           AND tbl_name IN ('pay_logs', 'money_logs')''').fetchall()
+    for name, _ in indexes:
+        database.execute('DROP INDEX {}'.format(name))
+
+    database.executemany(
+        'INSERT INTO pay_logs (account_id, drink_id, price, timestamp) VALUES (?, ?, ?, ?)',
+        pay_log_rows(rng, accounts, drinks, pay_logs, first_day, days))
+
+    spent = dict(database.execute(
+        'SELECT account_id, sum(price) FROM pay_logs GROUP BY account_id'))
+    money_logs, saldos = money_log_rows(rng, accounts, spent, first_day, days, min_balance)
+    database.executemany('INSERT INTO money_logs (account_id, amount, timestamp) VALUES (?, ?, ?)',
+                         money_logs)
+    database.executemany('UPDATE accounts SET saldo=? WHERE id=?',
+                         ((saldo, account_id) for account_id, saldo in saldos.items()))
+
+    for _, sql in indexes:
+        database.execute(sql)
+
+    build_rollups(database)
+    database.commit()
+    database.execute('PRAGMA journal_mode=wal')
+    database.close()
+
+def main():
+    """Generate a database"""
+    parser = argparse.ArgumentParser(description='Generate a Prepaid Mate database')
+    parser.add_argument('database', help='path of the new database')
+    parser.add_argument('--accounts', type=int, default=5000)
+    parser.add_argument('--pay-logs', type=int, default=1000000)
+    parser.add_argument('--drinks', type=int, default=30)
+    parser.add_argument('--years', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end-date', type=datetime.date.fromisoformat, default=END_DATE,
+                        help='last day of the data, YYYY-MM-DD (default: {})'.format(END_DATE))
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        print('{} exists, not overwriting it.'.format(args.database), file=sys.stderr)
+        exit(1)
+
+    start = time.perf_counter()
+    generate(args.database, args.accounts, args.pay_logs, args.drinks, args.years, args.seed,
+             end_date=args.end_date)
+    print('Generated {} in {:.1f}s'.format(args.database, time.perf_counter() - start))
+
+if __name__ == '__main__':
+    main()
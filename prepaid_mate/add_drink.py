@@ -3,7 +3,9 @@
 
 import os
 import sys
+import json
 import readline
+import time
 from configparser import ConfigParser
 
 import requests
@@ -47,10 +49,33 @@ def add_drink(config, name, content_ml, price, barcode):
     print('backend error: {}'.format(req.content.decode('utf-8')))
     return 1
 
-def get_last_unknown_code(config):
+def get_unknown_codes(config, max_age=600):
+    """
+    Returns list of (code, timestamp) tuples of unknown codes scanned in the
+    last "max_age" seconds, newest first.
+    """
     api_url = config.get('DEFAULT', 'api-url')
-    req = requests.get('{}/api/last_unknown_code'.format(api_url))
-    return req.content.decode('utf-8')
+    req = requests.get('{}/api/unknown_codes'.format(api_url),
+                       params={'since': int(time.time()) - max_age})
+    req.raise_for_status()
+    return json.loads(req.content.decode('utf-8'))
+
+def choose_unknown_code(config):
+    """Lets the user pick one of the recently scanned unknown codes."""
+    codes = get_unknown_codes(config)
+    if len(codes) < 2:
+        return codes[0][0] if codes else ''
+
+    print('Recently scanned unknown codes:')
+    for num, (code, timestamp) in enumerate(codes):
+        print('[{}] {} ({})'.format(num, code, time.strftime('%H:%M:%S',
+                                                             time.localtime(timestamp))))
+
+    choice = input('choose code [0]: ')
+    try:
+        return codes[int(choice or 0)][0]
+    except (ValueError, IndexError):
+        return ''
 
 def main():
     """Start scanner client with ./config"""
@@ -62,7 +87,7 @@ def main():
     config = ConfigParser()
     config.read_file(open(conf_file))
 
-    barcode = rlinput('barcode: ', get_last_unknown_code(config))
+    barcode = rlinput('barcode: ', choose_unknown_code(config))
     name = input('name: ')
     content_ml = input('content (in ml): ')
     price = input('price (in Cents): ')
@@ -2,31 +2,51 @@
 """Flask Prepaid Mate server"""
 
 import logging
-import os
 import sqlite3
 import json
-import tempfile
 import time
 
-from flask import Flask, g, request
+from flask import Flask, Response, g, request, stream_with_context
 from werkzeug.security import generate_password_hash
 from werkzeug.exceptions import BadRequestKeyError
 
 from .app_helper import (sql_integrity_error, get_db, query_db, password_check,
-                         superuser_password_check)
+                         superuser_password_check, user_password_check, check_db_settings,
+                         record_unknown_code, METRICS, POOL, SESSIONS)
+from .catalog import DRINKS
+from .history import EXPORT_FORMATS, export_rows, history, history_page
+from .payment import (MAX_BATCH_SIZE, MAX_IDEMPOTENCY_KEY_LENGTH, PaymentError, perform_payment,
+                      perform_payments)
+from .stats import stats
 
 app = Flask(__name__)  # pylint: disable=invalid-name
-UNKNOWN_CODE = tempfile.NamedTemporaryFile()
 
 @app.teardown_appcontext
-def close_connection(_):
+def close_connection(exc):
     """
-    Helper to retrieve DB connection
-    http://flask.pocoo.org/docs/1.0/patterns/sqlite3/
+    Hands the DB connection back to the pool, the connection is recycled if
+    the request failed with an exception
     """
-    database = getattr(g, '_database', None)
+    database = g.pop('_database', None)
     if database is not None:
-        database.close()
+        POOL.release(database, error=exc is not None)
+
+if METRICS is not None:
+    @app.before_request
+    def start_request_timer():
+        """Remembers when handling the request started."""
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_duration(response):
+        """Observes the request duration per route, method and status."""
+        start = g.pop('request_start', None)
+        if start is not None:
+            METRICS.observe('prepaid_mate_request_duration_seconds',
+                            time.perf_counter() - start,
+                            route=request.url_rule.rule if request.url_rule else 'unmatched',
+                            method=request.method, status=response.status_code)
+        return response
 
 @app.route('/api/account/create', methods=['POST'])
 def account_create():
@@ -48,8 +68,7 @@ def account_create():
         password = request.form['password']
         name = request.form['name']
 
-        drink_barcode = query_db('SELECT barcode FROM drinks WHERE barcode=?', [code], one=True)
-        if drink_barcode is not None:
+        if DRINKS.get(get_db(), code) is not None:
             return 'This code is already used for a drink', 400
 
         password_hash = generate_password_hash(password)
@@ -80,6 +99,7 @@ def account_create():
 def account_modify():
     """
     Modifies account identified by "name" and "password" with given parameters.
+    Changing name or password ends all sessions of the account.
 
     Expects POST parameters:
     - name
@@ -87,32 +107,34 @@ def account_modify():
     - new_name (optional)
     - new_password (optional)
     - new_code (optional)
+    - stats_opt_in (optional, "1" lists the account in the /api/stats
+      consumer ranking, "0" removes it)
+
+    Alternative POST parameters:
+    - token
+    - new_name, new_password, new_code, stats_opt_in (optional, see above)
 
     Alternative POST parameters:
     - superuserpassword
     - name
-    - new_name (optional)
-    - new_password (optional)
-    - new_code (optional)
+    - new_name, new_password, new_code, stats_opt_in (optional, see above)
 
     Returns 200 "ok"
     400 with error message
     500 on broken code
     """
     try:
-        password_check(app, request)
+        account_id, name = password_check(app, request)
     except (KeyError, TypeError, ValueError) as exc:
         app.logger.error(exc.args[0])
         return exc.args[0], 400
 
-    name = request.form['name']
-
     try:
         try:
             new_code = request.form['new_code']
             if not new_code:
                 raise BadRequestKeyError
-            query_db('UPDATE accounts SET barcode=? WHERE name=?', [new_code, name])
+            query_db('UPDATE accounts SET barcode=? WHERE id=?', [new_code, account_id])
         except BadRequestKeyError:
             # optional parameter
             pass
@@ -122,8 +144,8 @@ def account_modify():
             if not new_password:
                 raise BadRequestKeyError
             new_password_hash = generate_password_hash(request.form['new_password'])
-            query_db('UPDATE accounts SET password_hash=? WHERE name=?',
-                     [new_password_hash, name])
+            query_db('UPDATE accounts SET password_hash=? WHERE id=?',
+                     [new_password_hash, account_id])
         except BadRequestKeyError:
             # optional parameter
             pass
@@ -132,20 +154,30 @@ def account_modify():
             new_name = request.form['new_name']
             if not new_name:
                 raise BadRequestKeyError
-            query_db('UPDATE accounts SET name=? WHERE name=?',
-                     [new_name, name])
+            query_db('UPDATE accounts SET name=? WHERE id=?',
+                     [new_name, account_id])
         except BadRequestKeyError:
             pass
 
+        try:
+            stats_opt_in = request.form['stats_opt_in']
+            if stats_opt_in not in ('0', '1'):
+                raise ValueError('stats_opt_in must be 0 or 1')
+            query_db('UPDATE accounts SET stats_opt_in=? WHERE id=?',
+                     [int(stats_opt_in), account_id])
+        except BadRequestKeyError:
+            # optional parameter
+            pass
+
         get_db().commit()
         app.logger.info('Account "%s modified (name=%d, code=%d, password=%d)',
-                        request.form['name'], 'new_name' in request.form,
+                        name, 'new_name' in request.form,
                         'new_code' in request.form, 'new_password' in request.form)
 
     except Exception as exc:
         get_db().rollback()
         if isinstance(exc, ValueError):
-            exc_str = 'Incomplete request'
+            exc_str = exc.args[0] if exc.args else 'Incomplete request'
         elif isinstance(exc, sqlite3.IntegrityError):
             exc_str = sql_integrity_error(exc)
         elif isinstance(exc, sqlite3.OperationalError):
@@ -156,6 +188,55 @@ def account_modify():
 
     return 'ok'
 
+@app.route('/api/account/login', methods=['POST'])
+def account_login():
+    """
+    Starts a session for the account identified by "name" and "password".
+    The returned token can be passed as "token" instead of "name" and
+    "password" to the other API calls until it expires.
+
+    Expects POST parameters:
+    - name
+    - password
+
+    Returns 200 with session token
+    400 with error message
+    500 on broken code
+    """
+    try:
+        account_id, name = user_password_check(app, request)
+    except (KeyError, TypeError, ValueError) as exc:
+        app.logger.error(exc.args[0])
+        return exc.args[0], 400
+
+    app.logger.info('Session started for account "%s"', name)
+    return SESSIONS.issue(get_db(), account_id)
+
+@app.route('/api/account/logout', methods=['POST'])
+def account_logout():
+    """
+    Ends the session identified by "token".
+
+    Expects POST parameters:
+    - token
+
+    Returns 200 "ok"
+    400 with error message
+    500 on broken code
+    """
+    try:
+        SESSIONS.revoke(get_db(), request.form['token'])
+        get_db().commit()
+    except BadRequestKeyError:
+        exc_str = 'Incomplete request'
+        app.logger.warning(exc_str)
+        return exc_str, 400
+    except ValueError as exc:
+        app.logger.warning(exc.args[0])
+        return exc.args[0], 400
+
+    return 'ok'
+
 @app.route('/api/account/view', methods=['POST'])
 def account_view():
     """
@@ -165,8 +246,12 @@ def account_view():
     - name
     - password
 
+    Alternative POST parameters:
+    - token
+
     Returns 200 with json tuple (name, barcode, saldo)
     400 with error message
+    401 if the account of the session token no longer exists
     500 on broken code
     """
     try:
@@ -174,8 +259,13 @@ def account_view():
 
         account = query_db('SELECT name, barcode, saldo FROM accounts WHERE id=?',
                            [account_id], one=True)
+        if account is None:
+            raise TypeError('No such account in database')
     except (KeyError, TypeError, ValueError) as exc:
         app.logger.error(exc.args[0])
+        # the account of a still valid session token was deleted
+        if isinstance(exc, TypeError) and 'token' in request.form:
+            return exc.args[0], 401
         return exc.args[0], 400
 
     return json.dumps(tuple(account))
@@ -185,7 +275,7 @@ def account_exists():
     """
     Returns (True, <account name>, <saldo>) if the given account identified by
     code exists otherwise (False, None, None). If the account does not exist
-    the code is saved in a temporary file as a side-effect.
+    the code is added to the recent unknown codes as a side-effect.
 
     Expects POST parameters:
     - code
@@ -202,9 +292,7 @@ def account_exists():
         result = query_db('SELECT name, saldo FROM accounts WHERE barcode = ?',
                                        [code], one=True)
         if result is None:
-            UNKNOWN_CODE.truncate(0)
-            UNKNOWN_CODE.write(code.encode('utf-8'))
-            UNKNOWN_CODE.seek(0)
+            record_unknown_code(code)
         else:
             account_name, saldo = tuple(result)
 
@@ -221,6 +309,41 @@ def account_exists():
         app.logger.error(exc)
         return exc, 400
 
+@app.route('/api/code/resolve', methods=['POST'])
+def code_resolve():
+    """
+    Resolves a scanned code in one call. Returns ("account", <account name>,
+    <saldo>) for account codes, ("drink", <drink name>, <price>) for drink
+    barcodes and ("unknown", None, None) otherwise. Unknown codes are added to
+    the recent unknown codes as a side-effect.
+
+    Expects POST parameters:
+    - code
+
+    Returns 200 with json tuple (kind, name, saldo/price)
+    400 with error message
+    500 on broken code
+    """
+    try:
+        code = request.form['code']
+        account = query_db('SELECT name, saldo FROM accounts WHERE barcode=?', [code], one=True)
+        if account is not None:
+            return json.dumps(('account', account['name'], account['saldo']))
+
+        drink = DRINKS.get(get_db(), code)
+        if drink is not None:
+            return json.dumps(('drink', drink.name, drink.price))
+
+        record_unknown_code(code)
+        return json.dumps(('unknown', None, None))
+    except KeyError:
+        exc_str = 'Incomplete request'
+        app.logger.error(exc_str)
+        return exc_str, 400
+    except sqlite3.OperationalError as exc:
+        app.logger.error(exc)
+        return exc.args[0], 400
+
 @app.route('/api/money/add', methods=['POST'])
 def money_add():
     """
@@ -229,6 +352,7 @@ def money_add():
     Expects POST parameters:
     - name
     - password
+    - token (alternative to name/password)
     - money
 
     Alternative POST parameters:
@@ -290,9 +414,14 @@ def money_view():
     Expects POST parameters:
     - name
     - password
+    - token (alternative to name/password)
+    - limit (optional, page size)
+    - before (optional, cursor returned as "next" by the previous page)
 
     Returns 200 with json tuple (amount, transaction name, timestamp, drink
                                  barcode if available)
+    If "limit" is given, returns 200 with json object {"transactions": [tuples
+    as above], "next": cursor of the next page or null}
     400 with error message
     500 on broken code
     """
@@ -302,11 +431,25 @@ def money_view():
         app.logger.error(exc.args[0])
         return exc.args[0], 400
 
+    if 'limit' in request.form:
+        try:
+            limit = int(request.form['limit'])
+        except ValueError:
+            exc_str = 'limit must be integer'
+            app.logger.warning(exc_str)
+            return exc_str, 400
+
+        try:
+            transactions, next_cursor = history_page(account_id, limit,
+                                                     request.form.get('before'))
+        except ValueError as exc:
+            app.logger.warning(exc.args[0])
+            return exc.args[0], 400
+
+        return json.dumps({'transactions': transactions, 'next': next_cursor})
+
     try:
-        transactions = query_db(
-            'SELECT 0-drinks.price as amount, drinks.name as name, pay_logs.timestamp as timestamp, drinks.barcode as barcode FROM pay_logs INNER JOIN drinks ON pay_logs.drink_id=drinks.id WHERE pay_logs.account_id=? UNION SELECT amount, ? as drink_name, timestamp, "" as drinks_barcode FROM money_logs WHERE account_id=? ORDER BY timestamp DESC',  # pylint: disable=line-too-long
-            [account_id, 'Guthaben aufgeladen', account_id]
-        )
+        transactions = history(account_id)
     except BadRequestKeyError:
         exc_str = 'Incomplete request'
         app.logger.warning(exc_str)
@@ -316,7 +459,60 @@ def money_view():
         app.logger.error(exc_str)
         return exc_str, 400
 
-    return json.dumps([tuple(row) for row in transactions])
+    return json.dumps(transactions)
+
+@app.route('/api/money/export', methods=['POST'])
+def money_export():
+    """
+    Streams pay_logs and money_logs entries for accounting. This is
+    authorized with "superuserpassword".
+
+    Expects POST parameters:
+    - superuserpassword
+    - format (optional, "ndjson" (default) or "csv")
+    - since (optional, unix timestamp, inclusive)
+    - until (optional, unix timestamp, exclusive)
+    - account_code (optional, limits export to one account)
+
+    Returns 200 with one row per line, see history.EXPORT_COLUMNS
+    400 with error message
+    500 on broken code
+    """
+    try:
+        superuser_password_check(app, request, False)
+    except (KeyError, TypeError, ValueError) as exc:
+        app.logger.error(exc.args[0])
+        return exc.args[0], 400
+
+    try:
+        formatter, mimetype = EXPORT_FORMATS[request.form.get('format', 'ndjson')]
+    except KeyError:
+        exc_str = 'format must be one of {}'.format(', '.join(sorted(EXPORT_FORMATS)))
+        app.logger.warning(exc_str)
+        return exc_str, 400
+
+    try:
+        since = int(request.form.get('since') or 0)
+        until = int(request.form.get('until') or 2**62)
+    except ValueError:
+        exc_str = 'since and until must be integer'
+        app.logger.warning(exc_str)
+        return exc_str, 400
+
+    account_id = None
+    if request.form.get('account_code'):
+        account = query_db('SELECT id FROM accounts WHERE barcode=?',
+                           [request.form['account_code']], one=True)
+        if account is None:
+            exc_str = 'No such account in database'
+            app.logger.warning(exc_str)
+            return exc_str, 400
+        account_id = account['id']
+
+    app.logger.info('Exporting transactions (since=%d, until=%d, account ID=%s)',
+                    since, until, account_id)
+    rows = export_rows(get_db(), since, until, account_id)
+    return Response(stream_with_context(formatter(rows)), mimetype=mimetype)
 
 @app.route('/api/payment/perform', methods=['POST'])
 def payment_perform():
@@ -328,13 +524,17 @@ def payment_perform():
     - superuserpassword
     - account_code
     - drink_barcode
+    - timestamp (optional, unix timestamp of the sale, default: now, the drink
+      is charged at the price it had then)
+    - idempotency_key (optional, at most 128 characters, payments with a key
+      used before are rejected)
 
     Returns 200 with json tuple (amount, transaction name, timestamp)
     400 with error message
     500 on broken code
     """
     try:
-        superuser_password_check(app, request)
+        superuser_password_check(app, request, False)
     except (KeyError, TypeError, ValueError) as exc:
         app.logger.error(exc.args[0])
         return exc.args[0], 400
@@ -342,46 +542,28 @@ def payment_perform():
     try:
         account_code = request.form['account_code']
         drink_barcode = request.form['drink_barcode']
-
-        account = query_db('SELECT id, saldo FROM accounts WHERE barcode=?',
-                           [account_code], one=True)
-        try:
-            account_id, saldo = tuple(account)
-        except TypeError:
-            exc_str = 'Barcode does not belong to an account'
-            app.logger.warning(exc_str)
-            return exc_str, 400
-
-        if account_id is None:
-            exc_str = 'No such account in database'
-            app.logger.warning(exc_str)
-            return exc_str, 400
-
-        drink = query_db('SELECT id, price FROM drinks WHERE barcode=?', [drink_barcode], one=True)
-        try:
-            drink_id, drink_price = tuple(drink)
-        except TypeError:
-            exc_str = 'No such drink in database'
-            app.logger.warning(exc_str)
-            return exc_str, 400
-
-        if saldo - drink_price < 0:
-            exc_str = 'Insufficient funds'
-            app.logger.warning(exc_str)
-            return exc_str, 400
-
-        query_db('INSERT INTO pay_logs (account_id, drink_id, timestamp) VALUES (?, ?, strftime("%s", "now"))',  # pylint: disable=line-too-long
-                 [account_id, drink_id])
-        query_db('UPDATE accounts SET saldo=saldo-? WHERE id=?',
-                 [drink_price, account_id])
-        get_db().commit()
+        timestamp = request.form.get('timestamp') or None
+        if timestamp is not None:
+            try:
+                timestamp = int(timestamp)
+            except ValueError:
+                raise PaymentError('timestamp must be integer')
+
+        idempotency_key = request.form.get('idempotency_key') or None
+        if idempotency_key is not None and len(idempotency_key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+            raise PaymentError('idempotency_key must be at most {} characters'.format(
+                MAX_IDEMPOTENCY_KEY_LENGTH))
+
+        account_id, drink_id, drink_price, saldo = perform_payment(
+            account_code, drink_barcode, timestamp, idempotency_key)
         app.logger.warning('Account ID "%s" ordered %s (%d cents), new saldo=%d cents',
                            account_id, drink_id, drink_price, saldo)
-        return str(saldo - drink_price)
+        return str(saldo)
     except Exception as exc:  # pylint: disable=broad-except
-        get_db().rollback()
         if isinstance(exc, BadRequestKeyError):
             exc_str = 'Incomplete request'
+        elif isinstance(exc, PaymentError):
+            exc_str = exc.args[0]
         elif isinstance(exc, sqlite3.IntegrityError):
             exc_str = sql_integrity_error(exc)
         else:
@@ -390,6 +572,101 @@ def payment_perform():
         app.logger.warning(exc_str)
         return exc_str, 400
 
+@app.route('/api/payment/batch', methods=['POST'])
+def payment_batch():
+    """
+    Performs a list of payments in one transaction, e.g. payments a scanner
+    client recorded while the API was unreachable. This is authorized with
+    "superuserpassword".
+
+    Expects POST parameters:
+    - superuserpassword
+    - payments (json list of objects with "account_code", "drink_barcode" and
+      optional "timestamp" and "idempotency_key", see /api/payment/perform)
+
+    Returns 200 with json list containing {"saldo": new saldo} or
+    {"error": error message} per payment, each with the payment's
+    "idempotency_key"
+    400 with error message
+    500 on broken code
+    """
+    try:
+        superuser_password_check(app, request, False)
+    except (KeyError, TypeError, ValueError) as exc:
+        app.logger.error(exc.args[0])
+        return exc.args[0], 400
+
+    try:
+        payments = json.loads(request.form['payments'])
+        if not isinstance(payments, list):
+            raise ValueError('payments must be a list')
+        if len(payments) > MAX_BATCH_SIZE:
+            raise ValueError('at most {} payments per batch'.format(MAX_BATCH_SIZE))
+
+        batch = []
+        for payment in payments:
+            timestamp = payment.get('timestamp')
+            if timestamp is not None and (not isinstance(timestamp, int) or
+                                          isinstance(timestamp, bool)):
+                raise ValueError('timestamp must be integer')
+            idempotency_key = payment.get('idempotency_key')
+            if idempotency_key is not None and (
+                    not isinstance(idempotency_key, str) or
+                    not 0 < len(idempotency_key) <= MAX_IDEMPOTENCY_KEY_LENGTH):
+                raise ValueError('idempotency_key must be a non-empty string of at most {} '
+                                 'characters'.format(MAX_IDEMPOTENCY_KEY_LENGTH))
+            batch.append((str(payment['account_code']), str(payment['drink_barcode']),
+                          timestamp, idempotency_key))
+    except BadRequestKeyError:
+        return 'Incomplete request', 400
+    except (KeyError, AttributeError):
+        return 'Incomplete payment', 400
+    except ValueError as exc:
+        return exc.args[0], 400
+
+    results = []
+    for (_, _, _, idempotency_key), result in zip(batch, perform_payments(batch)):
+        if isinstance(result, PaymentError):
+            results.append({'idempotency_key': idempotency_key, 'error': result.args[0]})
+        elif isinstance(result, sqlite3.IntegrityError):
+            results.append({'idempotency_key': idempotency_key,
+                            'error': sql_integrity_error(result)})
+        else:
+            account_id, drink_id, drink_price, saldo = result
+            app.logger.warning('Account ID "%s" ordered %s (%d cents), new saldo=%d cents',
+                               account_id, drink_id, drink_price, saldo)
+            results.append({'idempotency_key': idempotency_key, 'saldo': saldo})
+
+    return json.dumps(results)
+
+@app.route('/api/snapshot', methods=['POST'])
+def snapshot():
+    """
+    Returns the accounts and drinks needed by scanner clients to keep selling
+    while the API is unreachable. This is authorized with "superuserpassword".
+
+    Expects POST parameters:
+    - superuserpassword
+
+    Returns 200 with json object {"accounts": [(code, name, saldo), ...],
+                                  "drinks": [(barcode, name, price), ...]}
+    400 with error message
+    500 on broken code
+    """
+    try:
+        superuser_password_check(app, request, False)
+    except (KeyError, TypeError, ValueError) as exc:
+        app.logger.error(exc.args[0])
+        return exc.args[0], 400
+
+    accounts = query_db('SELECT barcode, name, saldo FROM accounts WHERE barcode IS NOT NULL')
+    drinks = query_db('SELECT barcode, name, price FROM drinks')
+
+    return json.dumps({
+        'accounts': [tuple(row) for row in accounts],
+        'drinks': [tuple(row) for row in drinks],
+    })
+
 @app.route('/api/last_unknown_code', methods=['GET'])
 def last_unknown_code():
     """
@@ -398,13 +675,78 @@ def last_unknown_code():
     Returns 200 with last known code as string or empty string
     500 on broken code
     """
-    code = ''
+    code = query_db('SELECT code FROM unknown_codes WHERE timestamp > ? ORDER BY id DESC LIMIT 1',
+                    [int(time.time()) - 60], one=True)
+
+    return code['code'] if code is not None else ''
+
+@app.route('/api/unknown_codes', methods=['GET'])
+def unknown_codes():
+    """
+    Returns the recently scanned unknown codes, newest first. Each code is
+    listed once with the time it was seen last.
+
+    Expects GET parameters:
+    - since (optional, unix timestamp, exclusive)
+
+    Returns 200 with json list of tuples (code, timestamp)
+    400 with error message
+    500 on broken code
+    """
+    try:
+        since = int(request.args.get('since', 0))
+    except ValueError:
+        exc_str = 'since must be integer'
+        app.logger.warning(exc_str)
+        return exc_str, 400
 
-    if time.time() < os.stat(UNKNOWN_CODE.name).st_mtime + 60:
-        code = UNKNOWN_CODE.read().decode('utf-8')
-        UNKNOWN_CODE.seek(0)
+    codes = query_db('SELECT code, max(timestamp) AS timestamp FROM unknown_codes '
+                     'WHERE timestamp > ? GROUP BY code ORDER BY max(id) DESC', [since])
 
-    return code
+    return json.dumps([tuple(row) for row in codes])
+
+@app.route('/api/stats', methods=['GET'])
+def stats_view():
+    """
+    Returns consumption statistics of the last days, served from the daily
+    rollups.
+
+    Expects GET parameters:
+    - days (optional, default: 30)
+
+    Returns 200 with json object {"days": [(day start timestamp, drinks sold,
+    amount), ...], "drinks": [(barcode, name, drinks sold), ...],
+    "consumers": [(account name, drinks sold), ...]}, consumers only lists
+    accounts that opted in
+    400 with error message
+    500 on broken code
+    """
+    try:
+        days = int(request.args.get('days', 30))
+    except ValueError:
+        exc_str = 'days must be integer'
+        app.logger.warning(exc_str)
+        return exc_str, 400
+
+    try:
+        return json.dumps(stats(int(time.time()), days))
+    except ValueError as exc:
+        app.logger.warning(exc.args[0])
+        return exc.args[0], 400
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """
+    Returns request, SQL and password hashing timings of this worker process
+    as Prometheus histograms. Requires "metrics" to be enabled in the config.
+
+    Returns 200 with Prometheus text format
+    404 if metrics are disabled
+    """
+    if METRICS is None:
+        return 'Metrics disabled', 404
+
+    return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/drink/create', methods=['POST'])
 def drink_create():
@@ -437,9 +779,13 @@ def drink_create():
         if not all((name, barcode)):
             raise BadRequestKeyError
 
-        query_db('INSERT INTO drinks (name, content_ml, price, barcode) VALUES (?, ?, ?, ?)',
-                 [name, content_ml, price, barcode])
+        drink = query_db(
+            'INSERT INTO drinks (name, content_ml, price, barcode) VALUES (?, ?, ?, ?) RETURNING id',  # pylint: disable=line-too-long
+            [name, content_ml, price, barcode], one=True)
+        query_db('INSERT INTO drink_prices (drink_id, price, timestamp) VALUES (?, ?, strftime("%s", "now"))',  # pylint: disable=line-too-long
+                 [drink['id'], price])
         get_db().commit()
+        DRINKS.invalidate()
         app.logger.info('Drink "%s" added', name)
     except ValueError:
         exc_str = 'content_ml and price must be integer'
@@ -459,6 +805,66 @@ def drink_create():
 
     return 'ok'
 
+@app.route('/api/drink/modify', methods=['POST'])
+def drink_modify():
+    """
+    Changes the price of the drink identified by "barcode". Past transactions
+    keep the price they were charged at, the change is recorded in the price
+    history.
+
+    Expects POST parameters:
+    - superuserpassword
+    - barcode
+    - new_price (cents, positive)
+
+    Returns:
+    200 "ok"
+    400 with error message
+    500 on broken code
+    """
+    try:
+        superuser_password_check(app, request, False)
+    except (KeyError, TypeError, ValueError) as exc:
+        app.logger.error(exc.args[0])
+        return exc.args[0], 400
+
+    try:
+        barcode = request.form['barcode']
+        new_price = int(request.form['new_price'])
+        if new_price <= 0:
+            exc_str = 'price must be positive'
+            app.logger.warning(exc_str)
+            return exc_str, 400
+
+        # the drinks_price_history trigger adds the new price to drink_prices
+        drink = query_db('UPDATE drinks SET price=? WHERE barcode=? RETURNING name',
+                         [new_price, barcode], one=True)
+        if drink is None:
+            get_db().rollback()
+            exc_str = 'No such drink in database'
+            app.logger.warning(exc_str)
+            return exc_str, 400
+
+        get_db().commit()
+        DRINKS.invalidate()
+        app.logger.info('Price of drink "%s" changed to %d cents', drink['name'], new_price)
+    except ValueError:
+        exc_str = 'price must be integer'
+        app.logger.warning(exc_str)
+        return exc_str, 400
+    except BadRequestKeyError:
+        exc_str = 'Incomplete request'
+        app.logger.warning(exc_str)
+        return exc_str, 400
+    except sqlite3.OperationalError as exc:
+        # e.g. the database stayed locked by another worker
+        get_db().rollback()
+        exc_str = str(exc)
+        app.logger.error(exc_str)
+        return exc_str, 400
+
+    return 'ok'
+
 @app.route('/api/drink/view', methods=['POST'])
 def drink_view():
     """
@@ -473,7 +879,7 @@ def drink_view():
     """
     try:
         barcode = request.form['barcode']
-        drink = query_db('SELECT name, content_ml, price FROM drinks WHERE barcode=?', [barcode], one=True)
+        drink = DRINKS.get(get_db(), barcode)
 
     except (KeyError, BadRequestKeyError):
         exc_str = 'Incomplete request'
@@ -484,16 +890,20 @@ def drink_view():
         app.logger.error(exc_str)
         return exc_str, 400
 
-    try:
-        return json.dumps(tuple(drink))
-    except TypeError:
+    if drink is None:
         exc_str = 'No such drink in database'
         app.logger.warning(exc_str)
         return exc_str, 400
 
+    return json.dumps((drink.name, drink.content_ml, drink.price))
+
 if __name__ == "__main__":
     app.run(host='127.0.0.1')
 else:
     GUNICORN_LOGGER = logging.getLogger('gunicorn.error')
     app.logger.handlers = GUNICORN_LOGGER.handlers
     app.logger.setLevel(GUNICORN_LOGGER.level)
+
+    with app.app_context():
+        check_db_settings(app)
+        DRINKS.load(get_db())
@@ -1,7 +1,11 @@
 #!/usr/bin/env python3
 """Flask Prepaid Mate server helper"""
 
+import hashlib
+import hmac
+import logging
 import os
+import re
 import sqlite3
 from configparser import ConfigParser
 
@@ -9,10 +13,84 @@ from flask import g
 from werkzeug.security import check_password_hash
 from werkzeug.exceptions import BadRequestKeyError
 
+from .metrics import Metrics
+from .migrate import MIGRATIONS, schema_version
+from .pool import ConnectionPool
+from .ratelimit import FailureBackoff
+from .session import SessionStore
+from .slowlog import SlowQueryLog
+
 CONF = ConfigParser()
 CONF_FILE = os.environ.get('CONFIG', './config')
 CONF.read_file(open(CONF_FILE))
 
+# (pragma, config option, default), busy_timeout first so that switching the
+# journal mode waits for other workers
+PRAGMA_OPTIONS = (
+    ('busy_timeout', 'busy-timeout', '5000'),
+    ('journal_mode', 'journal-mode', 'wal'),
+    ('synchronous', 'synchronous', 'normal'),
+    ('cache_size', 'cache-size', '-8000'),
+    ('mmap_size', 'mmap-size', '0'),
+    ('temp_store', 'temp-store', 'memory'),
+)
+# pragmas reporting numbers for their named values
+PRAGMA_NAMED_VALUES = {
+    'synchronous': {'off': '0', 'normal': '1', 'full': '2', 'extra': '3'},
+    'temp_store': {'default': '0', 'file': '1', 'memory': '2'},
+}
+
+def pragma_profile():
+    """
+    Returns the pragmas configured in the DEFAULT section as list of
+    (pragma, value) tuples.
+    """
+    profile = []
+    for pragma, option, default in PRAGMA_OPTIONS:
+        value = CONF.get('DEFAULT', option, fallback=default).strip().lower()
+        if not re.match(r'^-?\w+$', value):
+            raise ValueError('Invalid value for {}: {}'.format(option, value))
+        profile.append((pragma, value))
+    return profile
+
+PRAGMA_PROFILE = pragma_profile()
+
+def apply_pragmas(database):
+    """Applies the configured pragma profile to the given DB connection"""
+    for pragma, value in PRAGMA_PROFILE:
+        database.execute('PRAGMA {}={}'.format(pragma, value)).close()
+
+POOL = ConnectionPool(CONF.get('DEFAULT', 'database'),
+                      max_uses=CONF.getint('DEFAULT', 'db-pool-max-uses', fallback=1000),
+                      cached_statements=CONF.getint('DEFAULT', 'db-statement-cache',
+                                                    fallback=128),
+                      on_connect=apply_pragmas)
+
+# None unless enabled by "metrics". Instrumentation wraps functions at import
+# time, so disabled metrics cost nothing.
+METRICS = Metrics() if CONF.getboolean('DEFAULT', 'metrics', fallback=False) else None
+if METRICS is not None:
+    check_password_hash = METRICS.timed(  # pylint: disable=invalid-name
+        'prepaid_mate_password_hash_duration_seconds')(check_password_hash)
+
+UNKNOWN_CODES_SIZE = 20
+
+# RETURNING (payments, drink creation) needs 3.35, UPSERT (rollups, ledger) 3.24
+MIN_SQLITE_VERSION = (3, 35, 0)
+
+# compared on every payment, so digest it once instead of reading the config
+SUPERUSER_DIGEST = hashlib.sha256(
+    CONF.get('DEFAULT', 'superuser-password').encode('utf-8')).digest()
+SUPERUSER_FAILURES = FailureBackoff()
+
+# tokens must validate on every worker, so the signing key is derived from the
+# config, optionally from a dedicated "session-secret"
+SESSIONS = SessionStore(
+    hashlib.sha256('prepaid-mate session {}'.format(
+        CONF.get('DEFAULT', 'session-secret',
+                 fallback=CONF.get('DEFAULT', 'superuser-password'))).encode('utf-8')).digest(),
+    lifetime=CONF.getint('DEFAULT', 'session-lifetime', fallback=900))
+
 def sql_integrity_error(exc):
     """Extract useful info from """
     assert isinstance(exc, sqlite3.IntegrityError)
@@ -26,15 +104,40 @@ def sql_integrity_error(exc):
 
 def get_db():
     """
-    Helper to retrieve DB connection, taken from
-    http://flask.pocoo.org/docs/1.0/patterns/sqlite3/
+    Helper to retrieve the pooled DB connection for the current app context,
+    based on http://flask.pocoo.org/docs/1.0/patterns/sqlite3/
     """
     database = getattr(g, '_database', None)
     if database is None:
-        database = g._database = sqlite3.connect(CONF.get('DEFAULT', 'database'))
-    database.row_factory = sqlite3.Row
+        database = g._database = POOL.acquire()
     return database
 
+def check_db_settings(app):
+    """
+    Logs the effective pragma settings of the DB connection and warns about
+    settings differing from the configured profile or an outdated schema.
+    Raises RuntimeError if the SQLite library is too old.
+    """
+    if sqlite3.sqlite_version_info < MIN_SQLITE_VERSION:
+        exc_str = 'SQLite {} is too old, Prepaid Mate needs at least {}'.format(
+            sqlite3.sqlite_version, '.'.join(str(part) for part in MIN_SQLITE_VERSION))
+        app.logger.critical(exc_str)
+        raise RuntimeError(exc_str)
+
+    version = schema_version(get_db())
+    if version < len(MIGRATIONS):
+        app.logger.warning('database schema version %d is outdated (current: %d), '
+                           'run prepaid-mate-migrate', version, len(MIGRATIONS))
+
+    for pragma, value in PRAGMA_PROFILE:
+        row = get_db().execute('PRAGMA {}'.format(pragma)).fetchone()
+        effective = str(row[0]).lower() if row is not None else None
+        app.logger.info('database setting %s=%s', pragma, effective)
+
+        if effective != PRAGMA_NAMED_VALUES.get(pragma, {}).get(value, value):
+            app.logger.warning('database setting %s is %s instead of configured %s',
+                               pragma, effective, value)
+
 def query_db(query, args=(), one=False):
     """
     Helper to query DB
@@ -45,16 +148,51 @@ def query_db(query, args=(), one=False):
     cur.close()
     return (result[0] if result else None) if one else result
 
+if METRICS is not None:
+    query_db = METRICS.timed_query(query_db)  # pylint: disable=invalid-name
+
+# statements slower than "slow-query-ms" are logged with their query plan, the
+# logger is a child of app.logger, so it uses the gunicorn handlers set up there
+if CONF.getfloat('DEFAULT', 'slow-query-ms', fallback=0) > 0:
+    query_db = SlowQueryLog(  # pylint: disable=invalid-name
+        CONF.getfloat('DEFAULT', 'slow-query-ms') / 1000,
+        logger=logging.getLogger('prepaid_mate.app.slowlog')).wrap(query_db, get_db)
+
+def record_unknown_code(code):
+    """
+    Adds code to the unknown_codes ring buffer, keeping the newest
+    UNKNOWN_CODES_SIZE entries, and commits.
+    """
+    query_db('INSERT INTO unknown_codes (code, timestamp) VALUES (?, strftime("%s", "now"))',
+             [code])
+    query_db('DELETE FROM unknown_codes WHERE id <= last_insert_rowid() - ?',
+             [UNKNOWN_CODES_SIZE])
+    get_db().commit()
+
 def password_check(app, req):
     """
     Calls superuser_password_check() if "superuserpassword" POST parameter is
-    set, user_password_check() otherwise
+    set, session_check() if "token" is set, user_password_check() otherwise
     """
     if 'superuserpassword' in req.form:
         return superuser_password_check(app, req)
 
+    if 'token' in req.form:
+        return session_check(app, req)
+
     return user_password_check(app, req)
 
+def session_check(app, req):
+    """
+    Helper to check the session token taken from "token" POST parameter.
+    Returns (id, name) tuple.
+    """
+    try:
+        return SESSIONS.validate(get_db(), req.form['token'])
+    except (TypeError, ValueError) as exc:
+        app.logger.info('session check failed: %s', exc.args[0])
+        raise
+
 def user_password_check(app, req):
     """
     Helper to check username and password, taken from "name" and "password"
@@ -83,17 +221,35 @@ def user_password_check(app, req):
 
     return (account_id, name)
 
+def client_address(req):
+    """
+    Returns the address of the client. X-Real-IP (set by nginx, see deploy/)
+    is only trusted for requests coming from a local proxy.
+    """
+    if req.remote_addr in (None, '', '127.0.0.1', '::1'):
+        return req.headers.get('X-Real-IP', req.remote_addr)
+    return req.remote_addr
+
 def superuser_password_check(app, req, account_check=True):
     """
     Helper to check superuser password and account name/code, taken from
     "superuserpassword", "name"/"account_code" POST parameters. If account_check is True
     Returns (id, name) tuple, otherwise None.
     """
-    if req.form['superuserpassword'] != \
-        CONF.get('DEFAULT', 'superuser-password'):
+    client = client_address(req)
+    if SUPERUSER_FAILURES.locked(client):
+        app.logger.warning('superuser password check for %s refused after too many failures',
+                           client)
+        raise ValueError('Too many failed attempts, try again later')
+
+    digest = hashlib.sha256(req.form['superuserpassword'].encode('utf-8')).digest()
+    if not hmac.compare_digest(digest, SUPERUSER_DIGEST):
+        SUPERUSER_FAILURES.failure(client)
         app.logger.warning('Account modification with wrong super user password')
         raise ValueError('Wrong superuserpassword')
 
+    SUPERUSER_FAILURES.success(client)
+
     if not account_check:
         return None
 
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Balance ledger audit script."""
+
+import os
+import sys
+import sqlite3
+from configparser import ConfigParser
+
+# Adds the amounts of pay/money log rows above the high-water mark of the log to
+# the per-account ledger totals. Both take the last processed id as parameter.
+LEDGER_UPDATES = {
+    'pay_logs': '''INSERT INTO ledger (account_id, paid)
+                   SELECT account_id, sum(price) FROM pay_logs
+                   WHERE id>? GROUP BY account_id
+                   ON CONFLICT (account_id) DO UPDATE SET paid=paid+excluded.paid''',
+    'money_logs': '''INSERT INTO ledger (account_id, added)
+                     SELECT account_id, sum(amount) FROM money_logs
+                     WHERE id>? GROUP BY account_id
+                     ON CONFLICT (account_id) DO UPDATE SET added=added+excluded.added''',
+}
+
+DRIFT_QUERY = '''SELECT accounts.id, accounts.name, accounts.saldo,
+                        coalesce(ledger.added, 0) - coalesce(ledger.paid, 0) AS expected
+                 FROM accounts LEFT JOIN ledger ON ledger.account_id=accounts.id
+                 WHERE accounts.saldo != expected
+                 ORDER BY accounts.id'''
+
+def audit(database):
+    """
+    Brings the ledger up to date, processing only log rows added since the
+    last run, and compares it to accounts.saldo. Both happen in one
+    transaction, so concurrent payments cannot show up as drift.
+    Returns list of (account_id, name, saldo, expected saldo) tuples of
+    accounts that drifted.
+    """
+    database.execute('BEGIN IMMEDIATE')
+    try:
+        for log, statement in LEDGER_UPDATES.items():
+            mark = database.execute('SELECT last_id FROM ledger_marks WHERE log=?',
+                                    [log]).fetchone()
+            last_id = mark[0] if mark is not None else 0
+            # ids only grow (AUTOINCREMENT), rows up to the mark were counted before
+            new_last_id = database.execute('SELECT max(id) FROM {}'.format(log)).fetchone()[0]
+            if new_last_id is None or new_last_id <= last_id:
+                continue
+
+            database.execute(statement, [last_id])
+            database.execute('INSERT OR REPLACE INTO ledger_marks (log, last_id) VALUES (?, ?)',
+                             [log, new_last_id])
+
+        drift = database.execute(DRIFT_QUERY).fetchall()
+        database.commit()
+    except BaseException:
+        database.rollback()
+        raise
+
+    return drift
+
+def main():
+    """Audit account balances of database configured in ./config"""
+    # assuming we can strip 'bin' and the venv directory to get the config directory
+    conf_dir = os.path.join(os.path.dirname(sys.argv[0]), '..', '..')
+    conf_path = os.path.join(conf_dir, './config')
+    conf_file = os.environ.get('CONFIG', conf_path)
+
+    config = ConfigParser()
+    try:
+        config.read_file(open(conf_file))
+    except FileNotFoundError:
+        print('Config file not found ({}), set path via CONFIG env variable.'.format(conf_dir))
+        exit(1)
+
+    database = sqlite3.connect(config.get('DEFAULT', 'database'), timeout=30)
+    try:
+        drift = audit(database)
+    except sqlite3.Error as exc:
+        print('Audit failed: {}'.format(exc))
+        exit(1)
+    finally:
+        database.close()
+
+    for account_id, name, saldo, expected in drift:
+        print('Account ID {} ({}): saldo {} cents, logs sum up to {} cents'.format(
+            account_id, name, saldo, expected))
+
+    exit(1 if drift else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""In-process drink catalog cache"""
+
+import threading
+from collections import namedtuple
+
+Drink = namedtuple('Drink', ('id', 'name', 'content_ml', 'price', 'barcode'))
+
+class DrinkCatalog:
+    """
+    Caches the (small) drinks table keyed by barcode and by id. Changes committed by
+    other connections, e.g. other workers, are noticed via PRAGMA data_version.
+    Changes made on the connection used for lookups must be announced with
+    invalidate().
+    """
+    def __init__(self):
+        self._drinks = None
+        self._drinks_by_id = None
+        self._connection = None
+        self._data_version = None
+        self._lock = threading.Lock()
+
+    def load(self, database):
+        """
+        (Re)loads the catalog using the given DB connection. Returns dict of
+        barcode -> Drink.
+        """
+        return self._load(database)[0]
+
+    def _load(self, database):
+        data_version = database.execute('PRAGMA data_version').fetchone()[0]
+        rows = database.execute('SELECT id, name, content_ml, price, barcode FROM drinks')
+        drinks = {row[4]: Drink(*row) for row in rows}
+        drinks_by_id = {drink.id: drink for drink in drinks.values()}
+
+        with self._lock:
+            self._drinks = drinks
+            self._drinks_by_id = drinks_by_id
+            # keep a reference, data_version is only comparable on the same connection
+            self._connection = database
+            self._data_version = data_version
+
+        return (drinks, drinks_by_id)
+
+    def get(self, database, barcode):
+        """Returns the Drink with the given barcode or None."""
+        return self._current(database)[0].get(barcode)
+
+    def by_id(self, database):
+        """
+        Returns dict of id -> Drink, e.g. to resolve the drinks of many log
+        rows with a single freshness check.
+        """
+        return self._current(database)[1]
+
+    def _current(self, database):
+        """Returns up-to-date (barcode -> Drink, id -> Drink) dicts."""
+        data_version = database.execute('PRAGMA data_version').fetchone()[0]
+        with self._lock:
+            drinks, drinks_by_id = self._drinks, self._drinks_by_id
+            if self._connection is not database or self._data_version != data_version:
+                drinks = None
+
+        if drinks is None:
+            return self._load(database)
+
+        return (drinks, drinks_by_id)
+
+    def invalidate(self):
+        """Drops the cached catalog, it is reloaded on the next lookup."""
+        with self._lock:
+            self._drinks = None
+            self._drinks_by_id = None
+            self._connection = None
+
+DRINKS = DrinkCatalog()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""Transaction export script."""
+
+import os
+import sys
+import argparse
+import calendar
+import time
+from configparser import ConfigParser
+
+import requests
+
+def parse_date(date):
+    """Converts "YYYY-MM-DD" (UTC) to a unix timestamp"""
+    return calendar.timegm(time.strptime(date, '%Y-%m-%d'))
+
+def export(config, out, export_format='ndjson', since=None, until=None, account_code=None):
+    """
+    Streams the transactions exported by the API to the binary file object
+    "out".
+    The config is used to retrieve the API URL and superuser password.
+    """
+    api_url = config.get('DEFAULT', 'api-url')
+    data = {
+        'superuserpassword': config.get('DEFAULT', 'superuser-password'),
+        'format': export_format,
+        'since': since or '',
+        'until': until or '',
+        'account_code': account_code or '',
+    }
+    try:
+        req = requests.post('{}/api/money/export'.format(api_url), data=data, stream=True)
+    except Exception as exc:
+        print(exc, file=sys.stderr)
+        return 1
+
+    with req:
+        if req.status_code == 200:
+            for chunk in req.iter_content(chunk_size=64 * 1024):
+                out.write(chunk)
+            return 0
+        if req.status_code == 400:
+            print('Error: {}'.format(req.content.decode('utf-8')), file=sys.stderr)
+            return 1
+
+        print('backend error: {}'.format(req.content.decode('utf-8')), file=sys.stderr)
+        return 1
+
+def main():
+    """Export transactions using ./config"""
+    parser = argparse.ArgumentParser(description='Export pay and money logs')
+    parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson')
+    parser.add_argument('--since', type=parse_date, help='first day (YYYY-MM-DD, UTC)')
+    parser.add_argument('--until', type=parse_date, help='day after the last (YYYY-MM-DD, UTC)')
+    parser.add_argument('--account', help='account code to export')
+    args = parser.parse_args()
+
+    # assuming we can strip 'bin' and the venv directory to get the config directory
+    conf_dir = os.path.join(os.path.dirname(sys.argv[0]), '..', '..')
+    conf_path = os.path.join(conf_dir, './config')
+    conf_file = os.environ.get('CONFIG', conf_path)
+
+    config = ConfigParser()
+    try:
+        config.read_file(open(conf_file))
+    except FileNotFoundError:
+        print('Config file not found ({}), set path via CONFIG env variable.'.format(conf_dir),
+              file=sys.stderr)
+        exit(1)
+
+    exit(export(config, sys.stdout.buffer, args.format, args.since, args.until, args.account))
+
+if __name__ == '__main__':
+    main()
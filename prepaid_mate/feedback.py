@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""Non-blocking audio and speech feedback for the scanner client."""
+
+import itertools
+import logging
+import queue
+import subprocess
+import threading
+
+class Feedback:
+    """
+    Plays sounds and speaks messages one after another in a background thread,
+    so the scanner loop never waits for audio. Status sounds are played before
+    pending speech, speech messages queued while audio is playing are merged
+    into one espeak call. Items may carry a tracing Span, its
+    "feedback_started" stage is marked when the item is played.
+    """
+    STATUS = 0
+    SPEECH = 1
+
+    def __init__(self, espeak_call, play_call, speak=True):
+        self.espeak_call = espeak_call
+        self.play_call = play_call
+        self.speak_enabled = speak
+        self.logger = logging.getLogger('feedback')
+        self._queue = queue.PriorityQueue()
+        # keeps FIFO order within a priority
+        self._counter = itertools.count()
+        self._thread = threading.Thread(target=self._run, name='feedback', daemon=True)
+        self._thread.start()
+
+    def _put(self, priority, kind, payload, span):
+        self._queue.put((priority, next(self._counter), kind, payload, span))
+
+    def play_status(self, wav, span=None):
+        """Queues a short status sound, played before pending speech."""
+        self._put(Feedback.STATUS, 'play', wav, span)
+
+    def play(self, wav, span=None):
+        """Queues a wav in line with speech messages (e.g. greetings)."""
+        self._put(Feedback.SPEECH, 'play', wav, span)
+
+    def speak(self, msg, span=None):
+        """Queues a message for espeak."""
+        if self.speak_enabled:
+            self._put(Feedback.SPEECH, 'speak', msg, span)
+
+    def join(self):
+        """Blocks until all queued feedback was given."""
+        self._queue.join()
+
+    @staticmethod
+    def _mark_started(spans, kind):
+        for span in spans:
+            if span is not None:
+                span.mark('feedback_started', kind=kind)
+
+    def _call(self, cmd):
+        try:
+            subprocess.call(cmd, shell=True)
+        except OSError as exc:
+            self.logger.error('feedback call failed: %s', exc)
+
+    def _next_messages(self, msg, span):
+        """
+        Returns (messages, spans) of msg and all speech messages queued
+        directly after it.
+        """
+        messages = [msg]
+        spans = [span]
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+
+            if item[2] != 'speak':
+                self._queue.put(item)
+                self._queue.task_done()
+                break
+
+            messages.append(item[3])
+            spans.append(item[4])
+            self._queue.task_done()
+
+        return (messages, spans)
+
+    def _run(self):
+        while True:
+            _, _, kind, payload, span = self._queue.get()
+            try:
+                if kind == 'play':
+                    self._mark_started([span], kind)
+                    self._call(self.play_call.format(wav=payload))
+                else:
+                    messages, spans = self._next_messages(payload, span)
+                    self._mark_started(spans, kind)
+                    self._call(self.espeak_call.format(msg='. '.join(messages)))
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""Prepaid Mate transaction history queries"""
+
+import csv
+import io
+import json
+
+from .app_helper import get_db, query_db
+from .catalog import DRINKS
+
+MONEY_ADDED_NAME = 'Guthaben aufgeladen'
+MAX_PAGE_SIZE = 500
+
+# Both history queries return (amount, drink_id, timestamp, log, id) rows,
+# drink_id is NULL for money_logs. Drink names and barcodes are resolved from
+# the catalog, the amount of a sale is the price stored at sale time.
+HISTORY_QUERY = '''
+SELECT 0-price AS amount, drink_id, timestamp, 1 AS log, id
+FROM pay_logs WHERE account_id=:account_id
+UNION ALL
+SELECT amount, NULL AS drink_id, timestamp, 0 AS log, id
+FROM money_logs WHERE account_id=:account_id
+ORDER BY timestamp DESC
+'''
+
+# Keyset pagination over pay_logs (log 1) and money_logs (log 0). Rows are
+# ordered by (timestamp, log, id) descending, each branch only reads "limit"
+# rows older than the cursor from its (account_id, timestamp) index.
+HISTORY_PAGE_QUERY = '''
+SELECT amount, drink_id, timestamp, log, id FROM (
+    SELECT 0-price AS amount, drink_id, timestamp, 1 AS log, id
+    FROM pay_logs
+    WHERE account_id=:account_id AND timestamp<=:timestamp
+          AND (timestamp, 1, id) < (:timestamp, :log, :id)
+    ORDER BY timestamp DESC, id DESC LIMIT :limit)
+UNION ALL
+SELECT amount, drink_id, timestamp, log, id FROM (
+    SELECT amount, NULL AS drink_id, timestamp, 0 AS log, id
+    FROM money_logs
+    WHERE account_id=:account_id AND timestamp<=:timestamp
+          AND (timestamp, 0, id) < (:timestamp, :log, :id)
+    ORDER BY timestamp DESC, id DESC LIMIT :limit)
+ORDER BY timestamp DESC, log DESC, id DESC LIMIT :limit
+'''
+
+# cursor before the newest possible transaction
+FIRST_CURSOR = (2**62, 0, 0)
+
+def parse_cursor(cursor):
+    """
+    Parses the opaque "before" cursor "<timestamp>:<log>:<id>" returned by
+    history_page(). Returns (timestamp, log, id) tuple, raises ValueError.
+    """
+    if not cursor:
+        return FIRST_CURSOR
+
+    try:
+        timestamp, log, id_ = (int(part) for part in cursor.split(':'))
+    except ValueError:
+        raise ValueError('Invalid cursor')
+
+    return (timestamp, log, id_)
+
+def _transactions(rows):
+    """
+    Turns history query rows into (amount, transaction name, timestamp,
+    drink barcode if available) tuples.
+    """
+    drinks = DRINKS.by_id(get_db())
+    transactions = []
+    for row in rows:
+        amount, drink_id, timestamp = row[0], row[1], row[2]
+        if drink_id is None:
+            transactions.append((amount, MONEY_ADDED_NAME, timestamp, ''))
+            continue
+
+        drink = drinks.get(drink_id)
+        transactions.append((amount, drink.name if drink else '', timestamp,
+                             drink.barcode if drink else ''))
+
+    return transactions
+
+def history(account_id):
+    """Returns all transactions of the given account (see history_page())."""
+    return _transactions(query_db(HISTORY_QUERY, {'account_id': account_id}))
+
+def history_page(account_id, limit, before=None):
+    """
+    Returns up to "limit" transactions of the given account older than the
+    "before" cursor as (transactions, next cursor) tuple. Transactions are
+    (amount, transaction name, timestamp, drink barcode if available) tuples,
+    the next cursor is None on the last page.
+    """
+    if not 0 < limit <= MAX_PAGE_SIZE:
+        raise ValueError('limit must be between 1 and {}'.format(MAX_PAGE_SIZE))
+
+    timestamp, log, id_ = parse_cursor(before)
+    rows = query_db(HISTORY_PAGE_QUERY, {
+        'account_id': account_id,
+        'timestamp': timestamp,
+        'log': log,
+        'id': id_,
+        'limit': limit,
+    })
+
+    next_cursor = None
+    if len(rows) == limit:
+        next_cursor = '{}:{}:{}'.format(rows[-1]['timestamp'], rows[-1]['log'], rows[-1]['id'])
+
+    return (_transactions(rows), next_cursor)
+
+EXPORT_COLUMNS = ('log', 'id', 'timestamp', 'account_id', 'account_name', 'amount',
+                  'drink_barcode', 'drink_name')
+EXPORT_QUERIES = (
+    '''SELECT 'pay' AS log, pay_logs.id, pay_logs.timestamp, pay_logs.account_id,
+              accounts.name, 0-pay_logs.price, pay_logs.drink_id
+       FROM pay_logs
+       INNER JOIN accounts ON pay_logs.account_id=accounts.id
+       WHERE pay_logs.timestamp>=:since AND pay_logs.timestamp<:until
+             AND (:account_id IS NULL OR pay_logs.account_id=:account_id)
+       ORDER BY pay_logs.id''',
+    '''SELECT 'money' AS log, money_logs.id, money_logs.timestamp, money_logs.account_id,
+              accounts.name, money_logs.amount, NULL
+       FROM money_logs
+       INNER JOIN accounts ON money_logs.account_id=accounts.id
+       WHERE money_logs.timestamp>=:since AND money_logs.timestamp<:until
+             AND (:account_id IS NULL OR money_logs.account_id=:account_id)
+       ORDER BY money_logs.id''',
+)
+EXPORT_BATCH_SIZE = 500
+
+def export_rows(database, since=0, until=2**62, account_id=None):
+    """
+    Generator yielding all pay_logs and then all money_logs rows (see
+    EXPORT_COLUMNS) with since <= timestamp < until, optionally limited to one
+    account. Rows are fetched in batches from the cursor, so memory usage does
+    not depend on the size of the export. Drinks are resolved from the
+    catalog.
+    """
+    drinks = DRINKS.by_id(database)
+    params = {'since': since, 'until': until, 'account_id': account_id}
+    for query in EXPORT_QUERIES:
+        cur = database.execute(query, params)
+        try:
+            while True:
+                rows = cur.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    drink = drinks.get(row[6])
+                    yield tuple(row)[:6] + ((drink.barcode, drink.name) if drink else ('', ''))
+        finally:
+            cur.close()
+
+def export_ndjson(rows):
+    """Generator turning export rows into newline delimited JSON objects"""
+    for row in rows:
+        yield json.dumps(dict(zip(EXPORT_COLUMNS, row))) + '\n'
+
+def export_csv(rows):
+    """Generator turning export rows into CSV lines, starting with a header"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() > 64 * 1024:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    yield buf.getvalue()
+
+EXPORT_FORMATS = {
+    'ndjson': (export_ndjson, 'application/x-ndjson'),
+    'csv': (export_csv, 'text/csv'),
+}
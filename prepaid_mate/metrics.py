@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""Request and SQL timing histograms in Prometheus text format"""
+
+import bisect
+import functools
+import threading
+import time
+
+# upper bounds in seconds, sqlite statements take well below a millisecond,
+# password hashing and slow requests take up to seconds
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1, 2.5, 5, 10)
+
+HELP = {
+    'prepaid_mate_request_duration_seconds': 'Time spent handling API requests',
+    'prepaid_mate_sql_duration_seconds': 'Time spent executing SQL statements via query_db',
+    'prepaid_mate_password_hash_duration_seconds': 'Time spent checking password hashes',
+}
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(key, _escape(value)) for key, value in pairs) + '}'
+
+class Histogram:
+    """Histogram with fixed buckets, guarded by the lock of its Metrics."""
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        """Counts value in the first bucket it fits in."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+class Metrics:
+    """
+    Collects histograms keyed by metric name and labels. The data is per
+    process, each gunicorn worker reports its own requests.
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        """Adds an observation (seconds) to the histogram of name and labels."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def timed(self, name, **labels):
+        """Decorator observing the duration of each call of the function."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+            return wrapper
+        return decorator
+
+    def timed_query(self, func):
+        """
+        Decorator for query_db() observing the duration of each call labeled
+        with the statement, whitespace collapsed.
+        """
+        @functools.wraps(func)
+        def wrapper(query, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(query, *args, **kwargs)
+            finally:
+                self.observe('prepaid_mate_sql_duration_seconds', time.perf_counter() - start,
+                             statement=' '.join(query.split()))
+        return wrapper
+
+    def render(self):
+        """Returns all histograms in the Prometheus text exposition format."""
+        with self._lock:
+            snapshot = sorted(((key, list(histogram.counts), histogram.total)
+                               for key, histogram in self._histograms.items()),
+                              key=lambda item: (item[0][0], str(item[0][1])))
+
+        lines = []
+        last_name = None
+        for (name, labels), counts, total in snapshot:
+            if name != last_name:
+                lines.append('# HELP {} {}'.format(name, HELP.get(name, name)))
+                lines.append('# TYPE {} histogram'.format(name))
+                last_name = name
+
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(labels, [('le', bound)]), cumulative))
+            lines.append('{}_sum{} {}'.format(name, _format_labels(labels), total))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels), cumulative))
+
+        return '\n'.join(lines) + '\n'
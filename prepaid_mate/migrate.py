@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""Database schema migration script."""
+
+import os
+import sys
+import sqlite3
+from configparser import ConfigParser
+
+def _check_pay_logs_prices(database):
+    """
+    Fails the migration if sales could not be given a price, their drinks
+    were deleted. History sums would silently skip them otherwise.
+    """
+    missing = database.execute('SELECT count(*) FROM pay_logs WHERE price IS NULL').fetchone()[0]
+    if missing:
+        raise sqlite3.IntegrityError(
+            '{} pay_logs rows refer to deleted drinks, their price is unknown. Add these '
+            'drinks again with their former id and price, then migrate again.'.format(missing))
+
+# The schema version (PRAGMA user_version) is the number of migrations applied.
+# Each migration is a tuple of SQL statements or functions taking the DB
+# connection. Never change or reorder released migrations, append new ones
+# instead.
+MIGRATIONS = (
+    # 1: account history lookups (money_view)
+    (
+        'CREATE INDEX pay_logs_account_id_timestamp ON pay_logs (account_id, timestamp)',
+    ),
+    # 2: account history lookups (money_view)
+    (
+        'CREATE INDEX money_logs_account_id_timestamp ON money_logs (account_id, timestamp)',
+    ),
+    # 3: sales per drink
+    (
+        'CREATE INDEX pay_logs_drink_id ON pay_logs (drink_id)',
+    ),
+    # 4: ring buffer of recently scanned unknown codes shared by all workers
+    (
+        '''CREATE TABLE unknown_codes (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            code TEXT NOT NULL,
+            timestamp INTEGER NOT NULL
+        )''',
+        'CREATE INDEX unknown_codes_timestamp ON unknown_codes (timestamp)',
+    ),
+    # 5: client supplied keys preventing payments from being replayed twice
+    (
+        'ALTER TABLE pay_logs ADD COLUMN idempotency_key TEXT',
+        'CREATE UNIQUE INDEX pay_logs_idempotency_key ON pay_logs (idempotency_key)',
+    ),
+    # 6: per-account totals of the logs and the last log ids counted (audit)
+    (
+        '''CREATE TABLE ledger (
+            account_id INTEGER NOT NULL PRIMARY KEY,
+            paid INTEGER NOT NULL DEFAULT 0,
+            added INTEGER NOT NULL DEFAULT 0,
+            FOREIGN KEY(account_id) REFERENCES accounts(id)
+        )''',
+        '''CREATE TABLE ledger_marks (
+            log TEXT NOT NULL PRIMARY KEY,
+            last_id INTEGER NOT NULL
+        )''',
+    ),
+    # 7: price at sale time, so price changes do not rewrite past transactions
+    (
+        'ALTER TABLE pay_logs ADD COLUMN price INTEGER',
+        'UPDATE pay_logs SET price=(SELECT price FROM drinks WHERE drinks.id=pay_logs.drink_id)',
+        _check_pay_logs_prices,
+        '''CREATE TABLE drink_prices (
+            id INTEGER NOT NULL PRIMARY KEY AUTOINCREMENT,
+            drink_id INTEGER NOT NULL,
+            price INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            FOREIGN KEY(drink_id) REFERENCES drinks(id)
+        )''',
+        'CREATE INDEX drink_prices_drink_id_timestamp ON drink_prices (drink_id, timestamp)',
+        # the price history of existing drinks starts with their current price
+        'INSERT INTO drink_prices (drink_id, price, timestamp) SELECT id, price, 0 FROM drinks',
+    ),
+    # 8: daily sales rollups (statistics) and opt-in for the consumer ranking
+    (
+        '''CREATE TABLE drink_sales_daily (
+            day INTEGER NOT NULL,
+            drink_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            PRIMARY KEY (day, drink_id)
+        ) WITHOUT ROWID''',
+        '''CREATE TABLE account_sales_daily (
+            day INTEGER NOT NULL,
+            account_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            amount INTEGER NOT NULL,
+            PRIMARY KEY (day, account_id)
+        ) WITHOUT ROWID''',
+        '''INSERT INTO drink_sales_daily (day, drink_id, count, amount)
+           SELECT timestamp / 86400, drink_id, count(*), sum(price) FROM pay_logs
+           GROUP BY timestamp / 86400, drink_id''',
+        '''INSERT INTO account_sales_daily (day, account_id, count, amount)
+           SELECT timestamp / 86400, account_id, count(*), sum(price) FROM pay_logs
+           GROUP BY timestamp / 86400, account_id''',
+        'ALTER TABLE accounts ADD COLUMN stats_opt_in INTEGER NOT NULL DEFAULT 0',
+    ),
+    # 9: logged out session tokens shared by all workers until they expire
+    (
+        '''CREATE TABLE revoked_sessions (
+            nonce TEXT NOT NULL PRIMARY KEY,
+            expiry REAL NOT NULL
+        ) WITHOUT ROWID''',
+        'CREATE INDEX revoked_sessions_expiry ON revoked_sessions (expiry)',
+    ),
+    # 10: price history of every price change, including manual edits
+    (
+        '''CREATE TRIGGER drinks_price_history AFTER UPDATE OF price ON drinks
+           WHEN NEW.price IS NOT OLD.price
+           BEGIN
+               INSERT INTO drink_prices (drink_id, price, timestamp)
+               VALUES (NEW.id, NEW.price, strftime('%s', 'now'));
+           END''',
+    ),
+)
+
+def schema_version(database):
+    """Returns the schema version of the given DB connection."""
+    return database.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(database):
+    """
+    Applies all pending migrations to the given DB connection. Each migration
+    runs in its own transaction together with the schema version update.
+    Returns a list of the applied schema versions.
+    """
+    applied = []
+    for version, statements in enumerate(MIGRATIONS, 1):
+        database.execute('BEGIN IMMEDIATE')
+        try:
+            # checked inside the transaction, another worker might have migrated
+            if schema_version(database) >= version:
+                database.rollback()
+                continue
+
+            for statement in statements:
+                if callable(statement):
+                    statement(database)
+                else:
+                    database.execute(statement)
+            database.execute('PRAGMA user_version = {:d}'.format(version))
+            database.commit()
+        except BaseException:
+            database.rollback()
+            raise
+
+        applied.append(version)
+
+    return applied
+
+def main():
+    """Apply pending migrations to database configured in ./config"""
+    # assuming we can strip 'bin' and the venv directory to get the config directory
+    conf_dir = os.path.join(os.path.dirname(sys.argv[0]), '..', '..')
+    conf_path = os.path.join(conf_dir, './config')
+    conf_file = os.environ.get('CONFIG', conf_path)
+
+    config = ConfigParser()
+    try:
+        config.read_file(open(conf_file))
+    except FileNotFoundError:
+        print('Config file not found ({}), set path via CONFIG env variable.'.format(conf_dir))
+        exit(1)
+
+    database = sqlite3.connect(config.get('DEFAULT', 'database'), timeout=30)
+    try:
+        print('Schema version: {}'.format(schema_version(database)))
+        for version in migrate(database):
+            print('Applied migration {}'.format(version))
+    except sqlite3.Error as exc:
+        print('Migration failed: {}'.format(exc))
+        exit(1)
+    finally:
+        database.close()
+
+    exit(0)
+
+if __name__ == '__main__':
+    main()
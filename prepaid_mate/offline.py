@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""Local journal keeping the scanner client selling while the API is unreachable."""
+
+import sqlite3
+import time
+import uuid
+
+class OfflineJournal:
+    """
+    SQLite file on the kiosk holding a snapshot of accounts and drinks and the
+    payments that could not be sent to the API. Every payment carries an
+    idempotency key, so replaying it cannot charge the account twice.
+    """
+    SCHEMA = (
+        '''CREATE TABLE IF NOT EXISTS accounts (
+            code TEXT NOT NULL PRIMARY KEY,
+            name TEXT NOT NULL,
+            saldo INTEGER NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS drinks (
+            barcode TEXT NOT NULL PRIMARY KEY,
+            name TEXT NOT NULL,
+            price INTEGER NOT NULL
+        )''',
+        '''CREATE TABLE IF NOT EXISTS payments (
+            idempotency_key TEXT NOT NULL PRIMARY KEY,
+            account_code TEXT NOT NULL,
+            drink_barcode TEXT NOT NULL,
+            price INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            error TEXT
+        )''',
+    )
+
+    def __init__(self, path):
+        # used by the client's worker thread only
+        self.database = sqlite3.connect(path, check_same_thread=False)
+        for statement in OfflineJournal.SCHEMA:
+            self.database.execute(statement)
+        self.database.commit()
+
+    @staticmethod
+    def new_key():
+        """Returns a new idempotency key."""
+        return str(uuid.uuid4())
+
+    def update_snapshot(self, accounts, drinks):
+        """
+        Replaces the snapshot with the given (code, name, saldo) accounts and
+        (barcode, name, price) drinks.
+        """
+        with self.database:
+            self.database.execute('DELETE FROM accounts')
+            self.database.execute('DELETE FROM drinks')
+            self.database.executemany('INSERT INTO accounts VALUES (?, ?, ?)', accounts)
+            self.database.executemany('INSERT INTO drinks VALUES (?, ?, ?)', drinks)
+
+    def resolve(self, code):
+        """
+        Resolves code like /api/code/resolve using the snapshot. The saldo of
+        accounts accounts for pending payments.
+        """
+        account = self.database.execute(
+            '''SELECT name, saldo - (SELECT coalesce(sum(price), 0) FROM payments
+                                     WHERE account_code=code AND error IS NULL)
+               FROM accounts WHERE code=?''', [code]).fetchone()
+        if account is not None:
+            return ('account',) + account
+
+        drink = self.database.execute('SELECT name, price FROM drinks WHERE barcode=?',
+                                      [code]).fetchone()
+        if drink is not None:
+            return ('drink',) + drink
+
+        return ('unknown', None, None)
+
+    def record(self, account_code, drink_barcode, idempotency_key):
+        """
+        Records a payment for later replay after checking it against the
+        snapshot. Returns the estimated new saldo, raises ValueError if the
+        payment is not possible.
+        """
+        kind, _, saldo = self.resolve(account_code)
+        if kind != 'account':
+            raise ValueError('Barcode does not belong to an account')
+
+        kind, _, price = self.resolve(drink_barcode)
+        if kind != 'drink':
+            raise ValueError('No such drink in database')
+
+        if saldo < price:
+            raise ValueError('Insufficient funds')
+
+        with self.database:
+            self.database.execute(
+                'INSERT OR IGNORE INTO payments VALUES (?, ?, ?, ?, ?, NULL)',
+                [idempotency_key, account_code, drink_barcode, price, int(time.time())])
+
+        return saldo - price
+
+    def pending(self):
+        """
+        Returns list of (idempotency_key, account_code, drink_barcode,
+        timestamp) tuples of payments waiting for replay, oldest first.
+        """
+        return self.database.execute(
+            '''SELECT idempotency_key, account_code, drink_barcode, timestamp FROM payments
+               WHERE error IS NULL ORDER BY timestamp, rowid''').fetchall()
+
+    def done(self, idempotency_key):
+        """Removes a replayed payment."""
+        with self.database:
+            self.database.execute('DELETE FROM payments WHERE idempotency_key=?',
+                                  [idempotency_key])
+
+    def failed(self, idempotency_key, error):
+        """Keeps a payment the API refused for manual inspection."""
+        with self.database:
+            self.database.execute('UPDATE payments SET error=? WHERE idempotency_key=?',
+                                  [error, idempotency_key])
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""Prepaid Mate payment engine"""
+
+import sqlite3
+
+from .app_helper import get_db, query_db
+from .catalog import DRINKS
+from .stats import record_sale
+
+# upper bound for payments per batch, keeps the write transaction short
+MAX_BATCH_SIZE = 1000
+# client generated keys are UUIDs, anything much longer is not a key
+MAX_IDEMPOTENCY_KEY_LENGTH = 128
+
+class PaymentError(Exception):
+    """Payment could not be performed, args[0] is the error message."""
+
+def _payment_error(account_code, drink):
+    """
+    Called after the guarded debit did not match an account row. Finds out
+    why and returns the PaymentError to raise.
+    """
+    account = query_db('SELECT id FROM accounts WHERE barcode=?', [account_code], one=True)
+    if account is None:
+        return PaymentError('Barcode does not belong to an account')
+    if drink is None:
+        return PaymentError('No such drink in database')
+    return PaymentError('Insufficient funds')
+
+def _price_at(drink, timestamp):
+    """
+    Returns the price of the drink at "timestamp" according to drink_prices,
+    the current price if the history does not go back that far.
+    """
+    row = query_db('SELECT price FROM drink_prices WHERE drink_id=? AND timestamp<=? '
+                   'ORDER BY timestamp DESC, id DESC LIMIT 1', [drink.id, timestamp], one=True)
+    return drink.price if row is None else row['price']
+
+def _debit(database, account_code, drink_barcode, timestamp, idempotency_key):
+    """
+    Debits and logs one payment within the caller's transaction and adds it
+    to the statistics. The balance check is part of the UPDATE statement.
+    Returns (account_id, drink_id, drink_price, new saldo) tuple, raises
+    PaymentError if the payment is not possible.
+    """
+    drink = DRINKS.get(database, drink_barcode)
+    if drink is None:
+        raise _payment_error(account_code, drink)
+
+    drink_id, drink_price = drink.id, drink.price
+    if timestamp is not None:
+        # sales replayed later are charged the price valid when they took place
+        drink_price = _price_at(drink, timestamp)
+    account = query_db(
+        'UPDATE accounts SET saldo=saldo-? WHERE barcode=? AND saldo>=? RETURNING id, saldo',
+        [drink_price, account_code, drink_price], one=True)
+
+    if account is None:
+        raise _payment_error(account_code, drink)
+
+    account_id, saldo = tuple(account)
+    log = query_db('INSERT INTO pay_logs (account_id, drink_id, price, timestamp, idempotency_key) VALUES (?, ?, ?, coalesce(?, strftime("%s", "now")), ?) RETURNING timestamp',  # pylint: disable=line-too-long
+                   [account_id, drink_id, drink_price, timestamp, idempotency_key], one=True)
+    record_sale(account_id, drink_id, drink_price, log['timestamp'])
+
+    return (account_id, drink_id, drink_price, saldo)
+
+def perform_payment(account_code, drink_barcode, timestamp=None, idempotency_key=None):
+    """
+    Debits the price of the drink identified by "drink_barcode" from the
+    account identified by "account_code" and logs the sale at "timestamp"
+    (default: now). A payment with an "idempotency_key" that was used before
+    fails with sqlite3.IntegrityError.
+
+    Debit plus log entry are written in one "BEGIN IMMEDIATE" transaction, so
+    concurrent payments on the same account cannot overdraw it.
+
+    Returns (account_id, drink_id, drink_price, new saldo) tuple, raises
+    PaymentError if the payment is not possible.
+    """
+    database = get_db()
+    database.execute('BEGIN IMMEDIATE')
+    try:
+        result = _debit(database, account_code, drink_barcode, timestamp, idempotency_key)
+        database.commit()
+    except BaseException:
+        database.rollback()
+        raise
+
+    return result
+
+def perform_payments(payments):
+    """
+    Performs a batch of payments given as (account_code, drink_barcode,
+    timestamp, idempotency_key) tuples in one "BEGIN IMMEDIATE" transaction,
+    so the whole batch costs a single commit. Each payment runs in its own
+    savepoint, a failing payment does not affect the others.
+
+    Returns list with a (account_id, drink_id, drink_price, new saldo) tuple
+    or the PaymentError/sqlite3.IntegrityError per payment.
+    """
+    database = get_db()
+    results = []
+    database.execute('BEGIN IMMEDIATE')
+    try:
+        for account_code, drink_barcode, timestamp, idempotency_key in payments:
+            database.execute('SAVEPOINT payment')
+            try:
+                results.append(_debit(database, account_code, drink_barcode, timestamp,
+                                      idempotency_key))
+            except (PaymentError, sqlite3.IntegrityError) as exc:
+                database.execute('ROLLBACK TO payment')
+                results.append(exc)
+            database.execute('RELEASE payment')
+
+        database.commit()
+    except BaseException:
+        database.rollback()
+        raise
+
+    return results
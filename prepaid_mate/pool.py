@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""Per worker SQLite connection pool"""
+
+import os
+import sqlite3
+import threading
+
+class ConnectionPool:
+    """
+    Hands out pre-opened SQLite connections, one per process and thread, so
+    connection setup, schema parsing and the page cache survive between
+    requests. A connection is recycled after "max_uses" acquisitions or when
+    it is released after an error. "on_connect" is called with every freshly
+    opened connection.
+    """
+    def __init__(self, database, max_uses=1000, cached_statements=128, on_connect=None):
+        self.database = database
+        self.max_uses = max_uses
+        self.cached_statements = cached_statements
+        self.on_connect = on_connect
+        self._local = threading.local()
+
+    def _connect(self):
+        connection = sqlite3.connect(self.database, cached_statements=self.cached_statements)
+        connection.row_factory = sqlite3.Row
+        if self.on_connect is not None:
+            self.on_connect(connection)
+        return connection
+
+    def acquire(self):
+        """Returns the connection of the calling thread, opens it if needed."""
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            # connections must not be shared with the parent after a fork
+            local.pid = os.getpid()
+            local.connection = None
+
+        if local.connection is None:
+            local.connection = self._connect()
+            local.uses = 0
+
+        local.uses += 1
+        return local.connection
+
+    def release(self, connection, error=False):
+        """
+        Hands the connection back. Open transactions are rolled back. The
+        connection is closed if "error" is set or it reached "max_uses".
+        """
+        try:
+            if connection.in_transaction:
+                connection.rollback()
+        except sqlite3.Error:
+            error = True
+
+        if error or self._local.uses >= self.max_uses:
+            self.discard()
+
+    def discard(self):
+        """Closes the connection of the calling thread."""
+        connection = getattr(self._local, 'connection', None)
+        self._local.connection = None
+        if connection is not None:
+            connection.close()
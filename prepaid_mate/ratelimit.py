@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""In-memory failure counter with exponential backoff"""
+
+import threading
+import time
+
+class FailureBackoff:
+    """
+    Counts failed attempts per client. After "free_attempts" failures every
+    further failure locks the client out for twice as long as the previous
+    one, starting with "base_delay" seconds and capped at "max_delay". A
+    successful attempt resets the client.
+    """
+    def __init__(self, free_attempts=3, base_delay=1, max_delay=300, max_clients=10000):
+        self.free_attempts = free_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_clients = max_clients
+        self._clients = {}  # client -> (failures, locked until)
+        self._lock = threading.Lock()
+
+    def locked(self, client):
+        """Returns the seconds the client is still locked out, 0 if it is not."""
+        with self._lock:
+            _, locked_until = self._clients.get(client, (0, 0))
+        return max(0, locked_until - time.time())
+
+    def failure(self, client):
+        """Records a failed attempt of the client."""
+        now = time.time()
+        with self._lock:
+            if len(self._clients) >= self.max_clients:
+                # forget clients that were not locked out recently
+                self._clients = {client_: entry for client_, entry in self._clients.items()
+                                 if entry[1] + self.max_delay > now}
+
+            failures, locked_until = self._clients.get(client, (0, 0))
+            failures += 1
+            if failures > self.free_attempts:
+                delay = self.base_delay * 2 ** min(failures - self.free_attempts - 1, 32)
+                locked_until = now + min(delay, self.max_delay)
+            self._clients[client] = (failures, locked_until)
+
+    def success(self, client):
+        """Resets the failure counter of the client."""
+        with self._lock:
+            self._clients.pop(client, None)
@@ -1,17 +1,21 @@
 #!/usr/bin/env python3
 """Client connecting to flask application server triggering payments."""
 
+import asyncio
 import logging
 import os
-import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
 import configparser
-import select
 import time
 import json
 
 import requests
-from evdev import InputDevice, categorize, ecodes
+from evdev import InputDevice, ecodes
+
+from .feedback import Feedback
+from .offline import OfflineJournal
+from .tracing import Tracer
 
 class UserError(Exception):
     """Errors the user is responsible for."""
@@ -19,6 +23,40 @@ class UserError(Exception):
 class BackendError(Exception):
     """Backend did not behave as expected."""
 
+# keycode -> digit, looked up for every key event
+KEY_DIGITS = {getattr(ecodes, 'KEY_{}'.format(digit)): str(digit) for digit in range(10)}
+# sent by some scanners around characters, irrelevant for numeric codes
+KEY_MODIFIERS = frozenset(getattr(ecodes, key) for key in ('KEY_LEFTSHIFT', 'KEY_RIGHTSHIFT'))
+
+class CodeDecoder:
+    """
+    Turns the input events of one device into codes. Digits are looked up in
+    KEY_DIGITS, ENTER finishes a code, KEY_MODIFIERS are ignored. A code may be
+    split across several feed() calls.
+    """
+    def __init__(self, logger):
+        self.logger = logger
+        self.digits = []
+
+    def feed(self, events):
+        """
+        Generator yielding (code, timestamp of the ENTER key event) tuples of
+        the codes finished by the given events.
+        """
+        for event in events:
+            # only key down events
+            if event.type != ecodes.EV_KEY or event.value != 1:  # pylint: disable=no-member
+                continue
+
+            digit = KEY_DIGITS.get(event.code)
+            if digit is not None:
+                self.digits.append(digit)
+            elif event.code == ecodes.KEY_ENTER:  # pylint: disable=no-member
+                yield (''.join(self.digits), event.timestamp())
+                self.digits = []
+            elif event.code not in KEY_MODIFIERS:
+                self.logger.warning('got unexpected %s', ecodes.KEY.get(event.code, event.code))
+
 class Mode(Enum):
     """Modes the ScannerClient can be in."""
     ACCOUNT = 1
@@ -33,12 +71,31 @@ class ScannerClient:
     CONF_SECTION = 'scanner-client'
     PAYMENT_SUCCEEDED_AUDIO = 'payment_success.wav'
     PAYMENT_FAILED_AUDIO = 'payment_failed.wav'
+    REPLAY_BATCH_SIZE = 100
 
     def __init__(self, config_file):
         self.conf = configparser.ConfigParser()
         self.conf.read_file(open(config_file))
         self.debug = self.conf.getboolean(ScannerClient.CONF_SECTION, 'debug')
         self.api_url = self.conf.get('DEFAULT', 'api-url')
+        self.api_timeout = (
+            self.conf.getfloat(ScannerClient.CONF_SECTION, 'api-connect-timeout', fallback=1),
+            self.conf.getfloat(ScannerClient.CONF_SECTION, 'api-read-timeout', fallback=5),
+        )
+        self.api_retries = self.conf.getint(ScannerClient.CONF_SECTION, 'api-retries',
+                                            fallback=2)
+        # keeps the connection to the API open between scans
+        self.session = requests.Session()
+        # payments made while the API is unreachable
+        self.journal = OfflineJournal(self.conf.get(ScannerClient.CONF_SECTION, 'offline-journal',
+                                                    fallback='./offline.sqlite'))
+        self.sync_interval = self.conf.getfloat(ScannerClient.CONF_SECTION,
+                                                'offline-sync-interval', fallback=60)
+        self.executor = None
+        # scan-to-feedback latency tracing, "span" is the scan being processed
+        trace_file = self.conf.get(ScannerClient.CONF_SECTION, 'trace-file', fallback='')
+        self.tracer = Tracer(trace_file) if trace_file else None
+        self.span = None
         self.mode = Mode.ACCOUNT
         self.account_code = None
         self.order_time = None
@@ -48,14 +105,38 @@ class ScannerClient:
         logging.basicConfig(level=loglevel)
         self.logger = logging.getLogger()
 
+        self.feedback = Feedback(self.conf.get(ScannerClient.CONF_SECTION, 'espeak-call'),
+                                 self.conf.get(ScannerClient.CONF_SECTION, 'play-call'),
+                                 speak=not self.debug)
+
         self.parse_add_balance_codes()
 
+    def api_post(self, endpoint, data, idempotent=False):
+        """
+        POSTs data to the given API endpoint using the persistent session.
+        Idempotent calls are retried with exponential backoff on connection
+        errors and timeouts.
+        """
+        retries = self.api_retries if idempotent else 0
+        for attempt in range(retries + 1):
+            try:
+                req = self.session.post('{}{}'.format(self.api_url, endpoint), data=data,
+                                        timeout=self.api_timeout)
+                if self.span is not None:
+                    self.span.mark('api_response', endpoint=endpoint)
+                return req
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt == retries:
+                    raise
+                self.logger.warning('API call %s failed, retrying', endpoint)
+                time.sleep(0.1 * 2**attempt)
+
+        return None
+
     def log_and_speak(self, msg, level=logging.INFO):
         """Logs the given message and uses espeak to inform the user"""
         self.logger.log(level, msg)
-        if not self.debug:
-            espeak_call = self.conf.get(ScannerClient.CONF_SECTION, 'espeak-call')
-            subprocess.Popen(espeak_call.format(msg=msg), shell=True)
+        self.feedback.speak(msg, span=self.span)
 
     def do_greet(self, name, max_size=480*1024):
         """
@@ -70,8 +151,7 @@ class ScannerClient:
 
         if os.path.isfile(greet_wav) and stat_size <= max_size:
             self.logger.info('playing {} as greeting for {}'.format(greet_wav, name))
-            greet_call = self.conf.get(ScannerClient.CONF_SECTION, 'play-call')
-            subprocess.Popen(greet_call.format(wav=greet_wav), shell=True)
+            self.feedback.play(greet_wav, span=self.span)
         else:
             if os.path.isfile(greet_wav):
                 self.logger.info('{} ({} bytes) exceeds maximum size ({} bytes), using espeak'
@@ -80,10 +160,9 @@ class ScannerClient:
             self.log_and_speak('hi {name}'.format(name=name))
 
     def play_status_sound(self, wav):
+        """Queues the status sound, it is played before pending speech."""
         if os.path.isfile(wav):
-            play_call = self.conf.get(ScannerClient.CONF_SECTION, 'play-call')
-            # intentional blocking call for short status sound
-            subprocess.call(play_call.format(wav=wav), shell=True)
+            self.feedback.play_status(wav, span=self.span)
 
     def cents_to_natural_speech(self, amount):
         amount = int(amount)
@@ -115,7 +194,7 @@ class ScannerClient:
             'account_code': self.account_code,
             'money': amount*100,
         }
-        req = requests.post('{}/api/money/add'.format(self.api_url), data=data)
+        req = self.api_post('/api/money/add', data)
 
         if req.status_code == 200:
             self.logger.info('add balance callback successful: %s', req.content.decode('utf-8'))
@@ -150,12 +229,12 @@ class ScannerClient:
                 raise UserError('Please identify first.')
 
             data = {'code': self.account_code}
-            req = requests.post('{}/api/account/code_exists'.format(self.api_url), data=data)
+            req = self.api_post('/api/code/resolve', data, idempotent=True)
             if req.status_code != 200:
                 raise BackendError('backend error during balance retrieval')
 
-            status, _, saldo = json.loads(req.content.decode('utf-8'))
-            assert status is True
+            kind, _, saldo = json.loads(req.content.decode('utf-8'))
+            assert kind == 'account'
             saldo = self.cents_to_natural_speech(saldo)
             self.log_and_speak('Your balance is {}'.format(saldo))
             self.reset()
@@ -177,22 +256,25 @@ class ScannerClient:
         self.logger.info('account code: %s', self.account_code)
 
         data = {'code': self.account_code}
-        req = requests.post('{}/api/account/code_exists'.format(self.api_url), data=data)
-        if req.status_code != 200:
-            raise BackendError('backend error during account verification')
+        try:
+            req = self.api_post('/api/code/resolve', data, idempotent=True)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.logger.warning('API unreachable, resolving code offline')
+            kind, name, value = self.journal.resolve(self.account_code)
+        else:
+            if req.status_code != 200:
+                raise BackendError('backend error during account verification')
+
+            kind, name, value = json.loads(req.content.decode('utf-8'))
 
-        status, name, _ = json.loads(req.content.decode('utf-8'))
-        if status:
+        if kind == 'account':
             self.do_greet(name)
+        elif kind == 'drink':
+            price = self.cents_to_natural_speech(value)
+            self.log_and_speak('Enjoy a cool {}, only {}'.format(name, price))
+            self.reset()
+            return False
         else:
-            req = requests.post('{}/api/drink/view'.format(self.api_url), data={'barcode': self.account_code})
-            if req.status_code == 200:
-                name, _, price = json.loads(req.content.decode('utf-8'))
-                price = self.cents_to_natural_speech(price)
-                self.log_and_speak('Enjoy a cool {}, only {}'.format(name, price))
-                self.reset()
-                return False
-
             raise UserError('code not recognized, register now')
 
         self.order_time = time.time()
@@ -207,9 +289,20 @@ class ScannerClient:
         data = {'superuserpassword': self.conf.get('DEFAULT', 'superuser-password')}
         data['drink_barcode'] = order_barcode
         data['account_code'] = self.account_code
+        # generated before the first attempt, a replay cannot charge twice
+        data['idempotency_key'] = OfflineJournal.new_key()
 
         self.logger.debug('calling API with %s', data)
-        req = requests.post('{}/api/payment/perform'.format(self.api_url), data=data)
+        try:
+            req = self.api_post('/api/payment/perform', data)
+        except requests.exceptions.ReadTimeout:
+            # the API got the request and may have debited the account already,
+            # journaling the payment for replay could charge it twice
+            self.logger.error('payment %s timed out, outcome unknown', data['idempotency_key'])
+            raise BackendError('Payment outcome unknown, please check your balance')
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.process_barcode_order_offline(order_barcode, data['idempotency_key'])
+            return
 
         if req.status_code == 200:
             self.logger.info('order callback successful: %s', req.content.decode('utf-8'))
@@ -223,17 +316,144 @@ class ScannerClient:
         else:
             raise BackendError('backend error during payment')
 
+    def process_barcode_order_offline(self, order_barcode, idempotency_key):
+        """
+        Records the order in the offline journal, it is sent to the API by
+        sync_offline() once the API is reachable again.
+        """
+        self.logger.warning('API unreachable, recording payment offline')
+        try:
+            saldo = self.journal.record(self.account_code, order_barcode, idempotency_key)
+        except ValueError as exc:
+            raise UserError('Payment failed: {}'.format(exc.args[0]))
+
+        self.play_status_sound(ScannerClient.PAYMENT_SUCCEEDED_AUDIO)
+        saldo = self.cents_to_natural_speech(saldo)
+        self.log_and_speak('Payment recorded offline: your balance is {}'.format(saldo))
+
+    def sync_offline(self):
+        """
+        Replays the payments of the offline journal and refreshes its snapshot
+        of accounts and drinks. Stops at the first connection error, the rest
+        is tried again on the next call.
+        """
+        password = self.conf.get('DEFAULT', 'superuser-password')
+        try:
+            pending = self.journal.pending()
+            for start in range(0, len(pending), ScannerClient.REPLAY_BATCH_SIZE):
+                batch = pending[start:start + ScannerClient.REPLAY_BATCH_SIZE]
+                payments = [{
+                    'account_code': account_code,
+                    'drink_barcode': drink_barcode,
+                    'timestamp': timestamp,
+                    'idempotency_key': key,
+                } for key, account_code, drink_barcode, timestamp in batch]
+                data = {'superuserpassword': password, 'payments': json.dumps(payments)}
+                req = self.api_post('/api/payment/batch', data, idempotent=True)
+                if req.status_code != 200:
+                    self.logger.error('replaying offline payments failed: %s',
+                                      req.content.decode('utf-8'))
+                    return
+
+                for result in json.loads(req.content.decode('utf-8')):
+                    key, error = result['idempotency_key'], result.get('error')
+                    if error is None or error == 'idempotency_key already exists':
+                        self.logger.info('replayed offline payment %s', key)
+                        self.journal.done(key)
+                    else:
+                        self.logger.error('offline payment %s refused: %s', key, error)
+                        self.journal.failed(key, error)
+
+            req = self.api_post('/api/snapshot', {'superuserpassword': password},
+                                idempotent=True)
+            if req.status_code != 200:
+                self.logger.error('snapshot failed: %s', req.content.decode('utf-8'))
+                return
+
+            snapshot = json.loads(req.content.decode('utf-8'))
+            self.journal.update_snapshot(snapshot['accounts'], snapshot['drinks'])
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            self.logger.warning('API unreachable, offline sync postponed')
+
     def reset(self):
         """Resets order specifics."""
         self.mode = Mode.ACCOUNT
         self.account_code = None
         self.order_time = None
 
-    def run(self):
-        """Endless loop grabbing content from barcode and RFID scanner."""
+    def process_input_code(self, code, rfid, span=None):
+        """
+        Processes a code read from the RFID scanner ("rfid" is True) or the
+        barcode scanner. Errors are reported to the user. The stages are
+        marked on the tracing span, if given.
+        """
+        self.span = span
+        if span is not None:
+            span.mark('processing_started', rfid=rfid)
+        try:
+            if rfid:
+                # hacky state machine shortcut
+                self.process_code_account(code)
+                self.mode = Mode.ORDER
+            else:
+                self.process_code(code)
+        except (UserError, BackendError, requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout) as exc:
+            self.log_and_speak(exc.args[0], level=logging.ERROR)
+            self.play_status_sound(ScannerClient.PAYMENT_FAILED_AUDIO)
+            self.reset()
+        finally:
+            if span is not None:
+                span.mark('processing_done')
+            self.span = None
+
+    async def read_codes(self, dev, codes):
+        """
+        Decodes the input events of dev and puts (dev, code, span) tuples into
+        the codes queue, span is None unless tracing is enabled. All events
+        pending on a wakeup are read at once.
+        """
+        decoder = CodeDecoder(self.logger)
+        while True:
+            events = await dev.async_read()
+            try:
+                for code, pressed in decoder.feed(events):
+                    span = None
+                    if self.tracer is not None:
+                        span = self.tracer.span()
+                        span.mark('key_enter', pressed)
+                        span.mark('code_decoded')
+                    await codes.put((dev, code, span))
+            except BlockingIOError:
+                # nothing to read after all
+                continue
+
+    async def process_codes(self, codes, rfid_dev):
+        """
+        Processes codes from the codes queue one after another. The blocking
+        API calls run in a single worker thread, so the devices are still
+        read in the meantime.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            dev, code, span = await codes.get()
+            await loop.run_in_executor(self.executor, self.process_input_code, code,
+                                       dev is rfid_dev, span)
+
+    async def sync_offline_periodically(self):
+        """Runs sync_offline() every "offline-sync-interval" seconds."""
+        loop = asyncio.get_running_loop()
+        while True:
+            # same worker thread as the scans, never races a payment
+            await loop.run_in_executor(self.executor, self.sync_offline)
+            await asyncio.sleep(self.sync_interval)
+
+    async def run_async(self):
+        """Reads barcode and RFID scanner and processes their codes concurrently."""
         scan_dev = InputDevice(self.conf.get(ScannerClient.CONF_SECTION, 'barcode-device'))
         rfid_dev = InputDevice(self.conf.get(ScannerClient.CONF_SECTION, 'rfid-device'))
-        code = ''
+        codes = asyncio.Queue()
+        self.executor = ThreadPoolExecutor(max_workers=1)
         try:
             if not self.debug:
                 scan_dev.grab()
@@ -241,39 +461,24 @@ class ScannerClient:
 
             self.logger.info('Prepaid Mate up and running')
 
-            while True:
-                readable_dev, _, _ = select.select([scan_dev, rfid_dev], [], [])
-                for dev in readable_dev:
-                    input_ = dev.read_one()
-                    event = categorize(input_)
-                    if input_.type != ecodes.EV_KEY or event.keystate != 1:  # pylint: disable=no-member
-                        continue
-
-                    key = event.keycode.replace('KEY_', '')
-                    if key.isdigit():
-                        code += key
-                    elif key == 'ENTER':
-                        try:
-                            if dev == rfid_dev:
-                                # hacky state machine shortcut
-                                self.process_code_account(code)
-                                self.mode = Mode.ORDER
-                            else:
-                                self.process_code(code)
-                        except (UserError, BackendError,
-                                requests.exceptions.ConnectionError) as exc:
-                            self.log_and_speak(exc.args[0], level=logging.ERROR)
-                            self.play_status_sound(ScannerClient.PAYMENT_FAILED_AUDIO)
-                            self.reset()
-                        finally:
-                            code = ''
-                    else:
-                        self.logger.warning('got unexpected %s from %s', event.keycode, dev)
+            await asyncio.gather(self.read_codes(scan_dev, codes),
+                                 self.read_codes(rfid_dev, codes),
+                                 self.process_codes(codes, rfid_dev),
+                                 self.sync_offline_periodically())
         finally:
+            self.executor.shutdown(wait=False)
             if not self.debug:
                 scan_dev.ungrab()
                 rfid_dev.ungrab()
 
+    def run(self):
+        """Endless loop grabbing content from barcode and RFID scanner."""
+        try:
+            asyncio.run(self.run_async())
+        finally:
+            # the feedback of the last scan is still given before exiting
+            self.feedback.join()
+
 
 def main():
     """Start scanner client with ./config"""
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Session tokens for the Prepaid Mate web UI"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import time
+
+class SessionStore:
+    """
+    Issues HMAC signed, short-lived session tokens. Validating a token costs
+    one HMAC and one SELECT by primary key instead of a password hash
+    verification. Tokens are bound to the name and password hash of their
+    account, so changing either ends all sessions on every worker. Logged out
+    tokens are kept in the revoked_sessions table until they would have
+    expired anyway.
+    """
+    def __init__(self, secret, lifetime=900):
+        self.secret = secret
+        self.lifetime = lifetime
+
+    def _sign(self, payload):
+        return hmac.new(self.secret, payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def _credential(self, name, password_hash):
+        """Returns the digest binding tokens to the current account credentials."""
+        return self._sign(json.dumps(['credential', name, password_hash]))
+
+    def issue(self, database, account_id):
+        """Returns a new session token for the given account."""
+        name, password_hash = database.execute(
+            'SELECT name, password_hash FROM accounts WHERE id=?', [account_id]).fetchone()
+        now = time.time()
+        payload = json.dumps([account_id, name, now + self.lifetime,
+                              binascii.hexlify(os.urandom(8)).decode('ascii'),
+                              self._credential(name, password_hash)])
+        payload = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+        return '{}.{}'.format(payload, self._sign(payload))
+
+    def _decode(self, token):
+        """Returns (account_id, name, expiry, nonce, credential) of a valid token."""
+        try:
+            payload, signature = token.rsplit('.', 1)
+            if not hmac.compare_digest(self._sign(payload), signature):
+                raise ValueError
+            return json.loads(base64.urlsafe_b64decode(payload.encode('ascii')).decode('utf-8'))
+        except (ValueError, TypeError, UnicodeError, binascii.Error):
+            raise ValueError('Invalid session')
+
+    def validate(self, database, token):
+        """
+        Checks the given token. Returns (id, name) tuple of the account,
+        raises TypeError if the account was deleted, ValueError otherwise.
+        """
+        account_id, name, expiry, nonce, credential = self._decode(token)
+        if expiry < time.time():
+            raise ValueError('Session expired')
+
+        account = database.execute(
+            '''SELECT name, password_hash,
+                   EXISTS (SELECT 1 FROM revoked_sessions WHERE nonce=?)
+               FROM accounts WHERE id=?''', [nonce, account_id]).fetchone()
+        if account is None:
+            raise TypeError('No such account in database')
+
+        current_name, password_hash, revoked = account
+        if revoked or not hmac.compare_digest(self._credential(current_name, password_hash),
+                                              credential):
+            raise ValueError('Session expired')
+
+        return (account_id, name)
+
+    def revoke(self, database, token):
+        """
+        Invalidates the given token (logout) and drops revocations of tokens
+        that expired in the meantime. The caller commits.
+        """
+        _, _, expiry, nonce, _ = self._decode(token)
+        database.execute('DELETE FROM revoked_sessions WHERE expiry < ?', [time.time()])
+        database.execute('INSERT OR IGNORE INTO revoked_sessions (nonce, expiry) VALUES (?, ?)',
+                         [nonce, expiry])
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Slow-query log with EXPLAIN QUERY PLAN output"""
+
+import functools
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+def fingerprint(query):
+    """Returns the statement with literals replaced and whitespace collapsed."""
+    query = re.sub(r"'(?:[^']|'')*'", '?', query)
+    query = re.sub(r'\b\d+\b', '?', query)
+    return ' '.join(query.split())
+
+def describe_args(args):
+    """
+    Returns the types of the bound parameters, their values may be password
+    hashes or session data and must not end up in the logs.
+    """
+    if isinstance(args, dict):
+        return '{{{}}}'.format(', '.join('{}: {}'.format(key, type(value).__name__)
+                                         for key, value in sorted(args.items())))
+    return '({})'.format(', '.join(type(value).__name__ for value in args))
+
+def explain(database, query, args):
+    """Returns the EXPLAIN QUERY PLAN output of the statement as indented text."""
+    try:
+        rows = database.execute('EXPLAIN QUERY PLAN {}'.format(query), args).fetchall()
+    except sqlite3.Error as exc:
+        return 'no plan: {}'.format(exc)
+
+    depths = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depths[node_id] = depths.get(parent, -1) + 1
+        lines.append('{}{}'.format('  ' * depths[node_id], detail))
+    return '\n'.join(lines)
+
+class SlowQueryLog:
+    """
+    Logs statements taking at least "threshold" seconds. The first occurrence
+    of a statement fingerprint is logged with parameter types and query plan,
+    repetitions only when their count reaches a power of two.
+    """
+    def __init__(self, threshold, logger=None):
+        self.threshold = threshold
+        self.logger = logger or logging.getLogger(__name__)
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, query_db, get_db):
+        """Decorates query_db(), get_db() returns the connection to explain on."""
+        @functools.wraps(query_db)
+        def wrapper(query, args=(), one=False):
+            start = time.perf_counter()
+            result = query_db(query, args, one)
+            duration = time.perf_counter() - start
+            if duration >= self.threshold:
+                self.record(get_db(), query, args, duration)
+            return result
+        return wrapper
+
+    def record(self, database, query, args, duration):
+        """Logs a slow statement, deduplicated by fingerprint."""
+        key = fingerprint(query)
+        with self._lock:
+            count = self._counts[key] = self._counts.get(key, 0) + 1
+
+        if count == 1:
+            self.logger.warning('slow query (%.1f ms): %s\nparameters: %s\nquery plan:\n%s',
+                                duration * 1000, key, describe_args(args),
+                                explain(database, query, args))
+        elif count & (count - 1) == 0:
+            self.logger.warning('slow query seen %d times (last %.1f ms): %s',
+                                count, duration * 1000, key)
@@ -1,8 +1,11 @@
 rfid_autofill = null;
+history_page_size = 50;
+history_cursor = null;
+history_loading = false;
 credentials = {
 	name: null,
 	rfid: null,
-	password: null,
+	token: null,
 }
 
 function cleanUp() {
@@ -12,28 +15,60 @@ function cleanUp() {
 	// clear RFID autofill timer
 	clearInterval(rfid_autofill);
 
+	// clear transaction history scroll handler
+	$(window).off('scroll');
+
 	// hide current content of the page
 	$('.view').hide();
 }
 
 function autoFillRFID() {
-	// auto fill RFID code (last unknown code inserted)
-	rfid_autofill = setInterval(function() {
-		if ($('#createModifyRFID').val() == '') {
-			$.get('/api/last_unknown_code', function(data) {
-				if (data != '' && $('#createModifyRFID').val() == '') {
-					$('#createModifyRFID').val(data);
-				}
-			});
-		}
-		if ($('#modifyRFID').val() == '') {
-			$.get('/api/last_unknown_code', function(data) {
-				if (data != '' && $('#modifyRFID').val() == '') {
-					$('#modifyRFID').val(data);
+	// offer the recently scanned unknown codes (newest first) in the RFID
+	// fields, a code scanned while the form is open is filled in directly
+	var seen = {}; // code -> timestamp it was seen last
+	var since = 0;
+	var first_poll = true;
+
+	$('#unknownCodes').empty();
+
+	var fill = function(code) {
+		$.each(['#createModifyRFID', '#modifyRFID'], function(i, field) {
+			if ($(field).val() == '') {
+				$(field).val(code);
+			}
+		});
+	};
+
+	var poll = function() {
+		$.getJSON('/api/unknown_codes', {since: since}, function(codes) {
+			var fresh = null;
+			// oldest first, so the newest code ends up on top of the list
+			$.each(codes.slice().reverse(), function(i, entry) {
+				var code = entry[0];
+				var timestamp = entry[1];
+				if (seen[code] !== undefined && seen[code] >= timestamp) {
+					return;
 				}
+				seen[code] = timestamp;
+				since = Math.max(since, timestamp - 1);
+				fresh = entry;
+
+				$('#unknownCodes option').filter(function() {
+					return this.value == code;
+				}).remove();
+				$('#unknownCodes').prepend($('<option>').val(code));
 			});
-		}
-	}, 1000);
+
+			// on the first poll only codes of the last minute count as just scanned
+			if (fresh != null && (!first_poll || fresh[1] > Date.now() / 1000 - 60)) {
+				fill(fresh[0]);
+			}
+			first_poll = false;
+		});
+	};
+
+	poll();
+	rfid_autofill = setInterval(poll, 1000);
 }
 
 function showLogin() {
@@ -49,12 +84,43 @@ function showLogin() {
 }
 
 function login() {
-	credentials.name = $('#InputUsername').val();
-	credentials.password = md5($('#InputPassword').val());
+	var loginCredentials = {
+		name: $('#InputUsername').val(),
+		password: md5($('#InputPassword').val())
+	}
 
-	$.post( //pass login credentials to api
+	$.post( //pass login credentials to api, get session token
+		'/api/account/login', loginCredentials,
+	).done( //on successful login show account
+		function( token ) {
+			credentials.name = loginCredentials.name;
+			credentials.token = token;
+			showAccount();
+		}
+	).fail( //on failed login attempt alert user and clear login inputs
+		function( errorMessage ) {
+			alert(errorMessage.responseText);
+			$('#start').show();
+			$('#InputUsername').val('');
+			$('#InputPassword').val('');
+		}
+	);
+}
+
+function logout() {
+	$.post(
+		'/api/account/logout', {token: credentials.token},
+	).always(
+		function() {
+			location.href = 'index.html';
+		}
+	);
+}
+
+function showAccount() {
+	$.post( //fetch account data of the current session
 		'/api/account/view', credentials,
-	).done( //on successful login call dashboard()
+	).done( //on success call dashboard()
 		function( accountData ) {
 			var rfid = jQuery.parseJSON(accountData)[1];
 			credentials.rfid = rfid;
@@ -118,8 +184,13 @@ function dashboard(accountData) {
 	$('#dashboard').show();
 	var userName = jQuery.parseJSON(accountData)[0];
 	$('#userNameDropdown').html(userName)
+	$('#transactionTableBody').empty();
+	history_cursor = null;
 	getPaymentData();
 	getCurrentBalance(accountData);
+
+	// load older transactions when scrolling to the end of the page
+	$(window).on('scroll', loadMorePaymentData);
 }
 
 function showModifyAccount() {
@@ -141,7 +212,7 @@ function modifyAccount() {
 		new_name: null,
 		new_code: null,
 		new_password: null,
-		password: credentials.password
+		token: credentials.token
 	}
 
 	if(!$('#modifyPassword').val()) {
@@ -176,8 +247,7 @@ function addBalance() {
 	if (regexBalance.test(balance)) {
 		balance = balance.replace(',', '.'); //balance can not contain ','
 		var balanceData = {
-			name: credentials.name,
-			password: credentials.password,
+			token: credentials.token,
 			money: balance * 100 //money has to be in cents
 		}
 
@@ -186,7 +256,7 @@ function addBalance() {
 		).done( //on successful login call dashboard()
 			function( transactionData ) {
 				$('#transactionTableBody').empty();
-				login();
+				showAccount();
 			}
 		).fail( //on failed login attempt alert user and clear login inputs
 			function( errorMessage ) {
@@ -206,12 +276,27 @@ function getCurrentBalance(accountData) {
 	$('#userBalance').html(currentBalance[2] / 100 + '&euro;');
 }
 
-function getPaymentData() {
-	$.post( //fetch transaction log from api
-		'/api/money/view', credentials,
+function loadMorePaymentData() {
+	if (history_cursor == null || history_loading)
+		return;
+
+	if ($(window).scrollTop() + $(window).height() > $(document).height() - 200)
+		getPaymentData(history_cursor);
+}
+
+function getPaymentData(before) {
+	var pageData = $.extend({limit: history_page_size}, credentials);
+	if (before)
+		pageData.before = before;
+
+	history_loading = true;
+	$.post( //fetch one page of the transaction log from api
+		'/api/money/view', pageData,
 	).done(//fetched transactionData successfully
 		function( transactionData ) {
-			var transactions = jQuery.parseJSON(transactionData);
+			var page = jQuery.parseJSON(transactionData);
+			var transactions = page.transactions;
+			history_cursor = page.next;
 			for(var i = 0; i < transactions.length; i++) {
 				//format unix time stamp to human readable format
 				var dateTransaction = new Date(transactions[i][2]*1000).toLocaleDateString();
@@ -249,8 +334,15 @@ function getPaymentData() {
 		}
 	).fail(//show error message from api
 		function( errorMessage ) {
+			history_cursor = null;
 			alert(errorMessage.responseText);
 		}
+	).always(
+		function() {
+			history_loading = false;
+			// page might not be scrollable yet
+			loadMorePaymentData();
+		}
 	);
 }
 
@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""Prepaid Mate consumption statistics"""
+
+from .app_helper import get_db, query_db
+from .catalog import DRINKS
+
+SECONDS_PER_DAY = 24 * 60 * 60
+MAX_DAYS = 366
+TOP_SIZE = 10
+
+# Daily rollups (days since the epoch, UTC) kept up to date by record_sale(),
+# so statistics never scan pay_logs.
+ROLLUP_UPSERTS = (
+    '''INSERT INTO drink_sales_daily (day, drink_id, count, amount) VALUES (?, ?, 1, ?)
+       ON CONFLICT (day, drink_id) DO UPDATE SET count=count+1, amount=amount+excluded.amount''',
+    '''INSERT INTO account_sales_daily (day, account_id, count, amount) VALUES (?, ?, 1, ?)
+       ON CONFLICT (day, account_id) DO UPDATE SET count=count+1, amount=amount+excluded.amount''',
+)
+
+def record_sale(account_id, drink_id, price, timestamp):
+    """Adds a sale to the daily rollups, called within the payment transaction."""
+    day = timestamp // SECONDS_PER_DAY
+    query_db(ROLLUP_UPSERTS[0], [day, drink_id, price])
+    query_db(ROLLUP_UPSERTS[1], [day, account_id, price])
+
+def stats(now, days=30):
+    """
+    Returns statistics of the last "days" days (including today) as dict:
+    - "days": [(day start timestamp, drinks sold, amount), ...], oldest first
+    - "drinks": [(barcode, name, drinks sold), ...], top TOP_SIZE
+    - "consumers": [(account name, drinks sold), ...], top TOP_SIZE of the
+      accounts that opted in
+    """
+    if not 0 < days <= MAX_DAYS:
+        raise ValueError('days must be between 1 and {}'.format(MAX_DAYS))
+
+    first_day = now // SECONDS_PER_DAY - days + 1
+    per_day = query_db(
+        '''SELECT day, sum(count), sum(amount) FROM drink_sales_daily WHERE day>=?
+           GROUP BY day ORDER BY day''', [first_day])
+    top_drinks = query_db(
+        '''SELECT drink_id, sum(count) AS sold FROM drink_sales_daily WHERE day>=?
+           GROUP BY drink_id ORDER BY sold DESC, drink_id LIMIT ?''', [first_day, TOP_SIZE])
+    top_consumers = query_db(
+        '''SELECT accounts.name, sum(count) AS sold FROM account_sales_daily
+           INNER JOIN accounts ON account_sales_daily.account_id=accounts.id
+           WHERE day>=? AND accounts.stats_opt_in
+           GROUP BY account_id ORDER BY sold DESC, account_id LIMIT ?''', [first_day, TOP_SIZE])
+
+    drinks = DRINKS.by_id(get_db())
+    return {
+        'days': [(day * SECONDS_PER_DAY, sold, amount) for day, sold, amount in per_day],
+        'drinks': [(drinks[drink_id].barcode, drinks[drink_id].name, sold)
+                   for drink_id, sold in top_drinks if drink_id in drinks],
+        'consumers': [tuple(row) for row in top_consumers],
+    }
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Scan-to-feedback latency tracing for the scanner client."""
+
+import argparse
+import itertools
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+
+# (segment, start stage, end stage) printed by the summary. Stages missing in a
+# span are skipped, e.g. scans without API call or feedback.
+SEGMENTS = (
+    ('decode', 'key_enter', 'code_decoded'),
+    ('queue', 'code_decoded', 'processing_started'),
+    ('api', 'processing_started', 'api_response'),
+    ('feedback', 'api_response', 'feedback_started'),
+    ('total', 'key_enter', 'feedback_started'),
+)
+
+class Span:
+    """Stages of one scan, each mark() is written to the trace log at once."""
+    def __init__(self, tracer, span_id):
+        self.tracer = tracer
+        self.span_id = span_id
+
+    def mark(self, stage, timestamp=None, **attrs):
+        """Records that the scan reached stage at timestamp (default: now)."""
+        record = {'span': self.span_id, 'stage': stage,
+                  'time': time.time() if timestamp is None else timestamp}
+        record.update(attrs)
+        self.tracer.write(record)
+
+class Tracer:
+    """
+    Writes stages of scans as JSON lines to "path". Stages are marked by the
+    event loop, the worker thread and the feedback thread, so writes are
+    serialized.
+    """
+    def __init__(self, path):
+        self._file = open(path, 'a', buffering=1)
+        self._lock = threading.Lock()
+        # span ids stay unique when the client is restarted
+        self._prefix = '{:x}'.format(int(time.time()))
+        self._ids = itertools.count()
+
+    def span(self):
+        """Returns a new Span."""
+        return Span(self, '{}-{}'.format(self._prefix, next(self._ids)))
+
+    def write(self, record):
+        """Appends record to the trace log."""
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._file.write(line)
+
+def read_spans(trace_file):
+    """
+    Returns dict of span id -> {stage: time} read from the JSON lines of
+    trace_file. The first api_response and feedback_started count.
+    """
+    spans = defaultdict(dict)
+    for line in trace_file:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            # line cut off by a crash
+            continue
+        spans[record['span']].setdefault(record['stage'], record['time'])
+    return spans
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of the sorted, non-empty values."""
+    return values[max(0, math.ceil(len(values) * percent / 100) - 1)]
+
+def summary(spans):
+    """Returns list of (segment, count, p50, p95, max) tuples in milliseconds."""
+    rows = []
+    for segment, start, end in SEGMENTS:
+        durations = sorted((stages[end] - stages[start]) * 1000 for stages in spans.values()
+                           if start in stages and end in stages)
+        if durations:
+            rows.append((segment, len(durations), percentile(durations, 50),
+                         percentile(durations, 95), durations[-1]))
+    return rows
+
+def main():
+    """Print the latency breakdown of a scanner client trace log"""
+    parser = argparse.ArgumentParser(description='Summarize a scanner client trace log')
+    parser.add_argument('trace_file', nargs='?', default='./scanner-trace.jsonl')
+    args = parser.parse_args()
+
+    with open(args.trace_file) as trace_file:
+        spans = read_spans(trace_file)
+
+    print('{} scans'.format(len(spans)))
+    print('{:10} {:>6} {:>10} {:>10} {:>10}'.format('segment', 'count', 'p50 ms', 'p95 ms',
+                                                    'max ms'))
+    for segment, count, p50, p95, maximum in summary(spans):
+        print('{:10} {:6d} {:10.1f} {:10.1f} {:10.1f}'.format(segment, count, p50, p95, maximum))
+
+if __name__ == '__main__':
+    main()
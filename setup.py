@@ -13,7 +13,7 @@ __name__ == '__main__' and setup(name='prepaid-mate',
         'evdev',
         'Flask'
     ],
-    python_requires='>=3.5',
+    python_requires='>=3.7',
     packages=find_packages(),
     zip_safe=False,
     entry_points={
@@ -21,5 +21,9 @@ __name__ == '__main__' and setup(name='prepaid-mate',
             'scanner-client = prepaid_mate.scanner_client:main',
             'prepaid-mate-reset-pw = prepaid_mate.reset_password:main',
             'prepaid-mate-new-drink = prepaid_mate.add_drink:main',
+            'prepaid-mate-migrate = prepaid_mate.migrate:main',
+            'prepaid-mate-export = prepaid_mate.export:main',
+            'prepaid-mate-audit = prepaid_mate.audit:main',
+            'prepaid-mate-trace-summary = prepaid_mate.tracing:main',
         ]
     })
@@ -17,18 +17,31 @@ def truncate_tables(db_fh, tables):
     database.commit()
     database.close()
 
+def migrate_db(db_fh):
+    """Apply all pending schema migrations"""
+    import sqlite3
+    from prepaid_mate.migrate import migrate
+
+    database = sqlite3.connect(db_fh.name)
+    migrate(database)
+    database.close()
+
 def create_test_db():
     """
-    Uses db.sqlite, generates temporary copy and truncates all tables but drinks
+    Uses db.sqlite, generates temporary copy, migrates it to the current schema
+    and truncates all tables but drinks
     """
     import tempfile
 
     with open(DB, 'rb') as testdb:
         tmp_db = tempfile.NamedTemporaryFile()
         tmp_db.write(testdb.read())
+        tmp_db.flush()
 
+        migrate_db(tmp_db)
         # order is important because of foreign keys
-        truncate_tables(tmp_db, ('pay_logs', 'money_logs', 'accounts'))
+        truncate_tables(tmp_db, ('drink_sales_daily', 'account_sales_daily', 'pay_logs',
+                                 'money_logs', 'accounts'))
 
         return tmp_db
 
@@ -121,10 +134,12 @@ def end_process(proc, cmd_name):
 def scanner_client(caplog):
     """Start scanner_client.py and emulate RFID and barcode scanner."""
     import logging
+    import tempfile
 
     procs = []
     configs = []
     names = []
+    journals = []
     def _scanner_client(enabled=('rfid', 'barcode')):
         # decrease log level to be able to debug scanner client
         caplog.set_level(logging.INFO)
@@ -138,7 +153,10 @@ def scanner_client(caplog):
         if isinstance(enabled, str):
             enabled = [enabled]
 
-        configs.append(create_test_config('scanner-client', **event_devices)[0])
+        # no journal state is shared between tests or written to the checkout
+        journals.append(tempfile.NamedTemporaryFile(suffix='.sqlite'))
+        configs.append(create_test_config('scanner-client', offline_journal=journals[-1].name,
+                                          **event_devices)[0])
         # run client
         cmd = 'umockdev-run'
         for name, dev in event_devices.items():
@@ -159,15 +177,19 @@ def scanner_client(caplog):
     yield _scanner_client
 
     # clean up
-    for proc, config, name in zip(procs, configs, names):
+    for proc, config, journal, name in zip(procs, configs, journals, names):
         end_process(proc, name)
 
-        # clean up tempfile by closing it
+        # clean up tempfiles by closing them
         config.close()
+        journal.close()
 
 @pytest.fixture(scope='function')
-def flask_server(caplog, pytestconfig):
-    """Start flask server."""
+def flask_server(caplog, pytestconfig, request):
+    """
+    Start flask server. Options of the DEFAULT section can be overridden by
+    indirect parametrization with a dict, e.g. {'metrics': '1'}.
+    """
     import logging
     import os
 
@@ -175,7 +197,8 @@ def flask_server(caplog, pytestconfig):
     caplog.set_level(logging.INFO)
     name = 'flask server'
     test_db = create_test_db()
-    test_config, config = create_test_config('DEFAULT', database=test_db.name)
+    options = getattr(request, 'param', {})
+    test_config, config = create_test_config('DEFAULT', database=test_db.name, **options)
 
     env = os.environ.copy()
     if pytestconfig.getoption("verbose"):
@@ -211,3 +211,169 @@ def test_account_code_does_not_exist_60s(flask_server):
     # code should not be available anymore
     req = requests.get('{}/last_unknown_code'.format(API_URL))
     assert not req.content.decode('utf-8')
+
+def test_account_session_good(flask_server, create_account):
+    """Test if API calls work with a session token and logout ends the session."""
+    import json
+    import requests
+
+    data = create_account
+    req = requests.post('{}/account/login'.format(API_URL), data=data)
+    assert req.status_code == 200
+    token = req.content.decode('utf-8')
+
+    req = requests.post('{}/money/add'.format(API_URL), data={'token': token, 'money': 100})
+    assert req.content == b'100'
+    assert req.status_code == 200
+
+    req = requests.post('{}/account/view'.format(API_URL), data={'token': token})
+    assert req.status_code == 200
+    assert json.loads(req.content.decode('utf-8')) == [data['name'], data['code'], 100]
+
+    req = requests.post('{}/account/logout'.format(API_URL), data={'token': token})
+    assert req.content == b'ok'
+    assert req.status_code == 200
+
+    req = requests.post('{}/account/view'.format(API_URL), data={'token': token})
+    assert req.content == b'Session expired'
+    assert req.status_code == 400
+
+def test_account_session_invalid(flask_server, create_account):
+    """Test if login with wrong password and forged tokens fail as expected."""
+    import copy
+    import requests
+
+    data = copy.copy(create_account)
+    data['password'] = 'wrong'
+    req = requests.post('{}/account/login'.format(API_URL), data=data)
+    assert req.content == b'Wrong password'
+    assert req.status_code == 400
+
+    req = requests.post('{}/account/login'.format(API_URL), data=create_account)
+    token = req.content.decode('utf-8')
+    payload, signature = token.rsplit('.', 1)
+
+    for forged_token in ('', 'foo', payload, '{}.{}'.format(payload, signature[::-1])):
+        req = requests.post('{}/account/view'.format(API_URL), data={'token': forged_token})
+        assert req.content == b'Invalid session'
+        assert req.status_code == 400
+
+def test_account_session_password_change(flask_server, create_account):
+    """Test if changing the password ends existing sessions."""
+    import requests
+
+    req = requests.post('{}/account/login'.format(API_URL), data=create_account)
+    token = req.content.decode('utf-8')
+
+    req = requests.post('{}/account/modify'.format(API_URL),
+                        data={'token': token, 'new_password': 'bar2'})
+    assert req.content == b'ok'
+    assert req.status_code == 200
+
+    req = requests.post('{}/account/view'.format(API_URL), data={'token': token})
+    assert req.content == b'Session expired'
+    assert req.status_code == 400
+
+    data = {'name': create_account['name'], 'password': 'bar2'}
+    req = requests.post('{}/account/login'.format(API_URL), data=data)
+    assert req.status_code == 200
+
+def test_account_session_deleted_account(flask_server, create_account):
+    """Test if a session token of a deleted account is refused with 401."""
+    import sqlite3
+    import requests
+
+    config = flask_server
+    req = requests.post('{}/account/login'.format(API_URL), data=create_account)
+    token = req.content.decode('utf-8')
+
+    database = sqlite3.connect(config['DEFAULT']['database'])
+    database.execute('DELETE FROM accounts WHERE name=?', [create_account['name']])
+    database.commit()
+    database.close()
+
+    req = requests.post('{}/account/view'.format(API_URL), data={'token': token})
+    assert req.content == b'No such account in database'
+    assert req.status_code == 401
+
+def test_session_store_workers(tmp_path):
+    """Test if logout and password changes end sessions on all workers."""
+    import shutil
+    import sqlite3
+    import pytest
+    from prepaid_mate.migrate import migrate
+    from prepaid_mate.session import SessionStore
+
+    db_path = str(tmp_path / 'sessions.sqlite')
+    shutil.copyfile('./db.sqlite', db_path)
+    database = sqlite3.connect(db_path)
+    migrate(database)
+    account_id = database.execute(
+        "INSERT INTO accounts (name, password_hash, barcode, saldo) VALUES ('foo', 'hash', '1', 0)"
+    ).lastrowid
+    database.commit()
+
+    # each worker has its own store, they only share the secret and the database
+    worker1 = SessionStore(b'secret')
+    worker2 = SessionStore(b'secret')
+
+    token = worker1.issue(database, account_id)
+    other_token = worker1.issue(database, account_id)
+    assert worker2.validate(database, token) == (account_id, 'foo')
+
+    worker1.revoke(database, token)
+    database.commit()
+    with pytest.raises(ValueError, match='Session expired'):
+        worker2.validate(database, token)
+    assert worker2.validate(database, other_token) == (account_id, 'foo')
+
+    database.execute("UPDATE accounts SET password_hash='new hash' WHERE id=?", [account_id])
+    database.commit()
+    with pytest.raises(ValueError, match='Session expired'):
+        worker2.validate(database, other_token)
+    database.close()
+
+def test_unknown_codes(flask_server, create_account):
+    """Test if recently scanned unknown codes are listed newest first."""
+    import json
+    import time
+    import requests
+
+    for code in ('1', '2', '1', create_account['code']):
+        req = requests.post('{}/account/code_exists'.format(API_URL), data={'code': code})
+        assert req.status_code == 200
+
+    req = requests.get('{}/unknown_codes'.format(API_URL))
+    assert req.status_code == 200
+    codes = json.loads(req.content.decode('utf-8'))
+    assert [code for code, _ in codes] == ['1', '2']
+    assert all(0 < timestamp <= time.time() for _, timestamp in codes)
+
+    req = requests.get('{}/unknown_codes'.format(API_URL), params={'since': int(time.time())})
+    assert json.loads(req.content.decode('utf-8')) == []
+
+    req = requests.get('{}/unknown_codes'.format(API_URL), params={'since': 'foo'})
+    assert req.content == b'since must be integer'
+    assert req.status_code == 400
+
+def test_code_resolve(flask_server, create_account_with_balance, create_drink):
+    """Test if codes are resolved to accounts, drinks or unknown codes."""
+    import json
+    import requests
+
+    account = create_account_with_balance(150)
+    drink = create_drink
+
+    for code, expected in ((account['code'], ['account', account['name'], 150]),
+                           (drink['barcode'], ['drink', drink['name'], drink['price']]),
+                           ('1234', ['unknown', None, None])):
+        req = requests.post('{}/code/resolve'.format(API_URL), data={'code': code})
+        assert req.status_code == 200
+        assert json.loads(req.content.decode('utf-8')) == expected
+
+    req = requests.get('{}/last_unknown_code'.format(API_URL))
+    assert req.content == b'1234'
+
+    req = requests.post('{}/code/resolve'.format(API_URL))
+    assert req.content == b'Incomplete request'
+    assert req.status_code == 400
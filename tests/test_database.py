@@ -0,0 +1,87 @@
+"""Tests database setup of the flask server."""
+# disable unused arguments used to run fixtures
+# pylint: disable=unused-argument
+
+def test_database_wal(flask_server, create_account):
+    """Test if the configured journal mode is applied to the database."""
+    import sqlite3
+
+    config = flask_server
+    database = sqlite3.connect(config['DEFAULT']['database'])
+    assert database.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert database.execute('SELECT name FROM accounts').fetchall() == [('foo',)]
+    database.close()
+
+def test_database_migrate(tmp_path):
+    """Test if migrations are applied once and the history lookups use them."""
+    import shutil
+    import sqlite3
+    from prepaid_mate.migrate import MIGRATIONS, migrate, schema_version
+
+    db_path = str(tmp_path / 'db.sqlite')
+    shutil.copyfile('./db.sqlite', db_path)
+    database = sqlite3.connect(db_path)
+
+    version = schema_version(database)
+    assert migrate(database) == list(range(version + 1, len(MIGRATIONS) + 1))
+    assert schema_version(database) == len(MIGRATIONS)
+    assert migrate(database) == []
+
+    for table in ('pay_logs', 'money_logs'):
+        plan = database.execute(
+            'EXPLAIN QUERY PLAN SELECT timestamp FROM {} WHERE account_id=? '
+            'ORDER BY timestamp DESC'.format(table), [1]).fetchall()
+        assert 'USING' in plan[0][3] and 'INDEX' in plan[0][3]
+
+    database.close()
+
+def test_database_migrate_deleted_drink(tmp_path):
+    """Test if the price backfill fails loudly for sales of deleted drinks."""
+    import shutil
+    import sqlite3
+    import pytest
+    from prepaid_mate.migrate import migrate, schema_version
+
+    db_path = str(tmp_path / 'db.sqlite')
+    shutil.copyfile('./db.sqlite', db_path)
+    database = sqlite3.connect(db_path)
+    database.execute("INSERT INTO pay_logs (account_id, drink_id, timestamp) VALUES (1, 9999, 0)")
+    database.commit()
+
+    with pytest.raises(sqlite3.IntegrityError, match='1 pay_logs rows refer to deleted drinks'):
+        migrate(database)
+    # migrations before the price backfill stay applied
+    assert schema_version(database) == 6
+    database.close()
+
+def test_database_audit(flask_server, create_account_with_balance):
+    """Test if the audit counts new log rows only and reports drifted balances."""
+    import sqlite3
+    import pytest
+    import requests
+    from prepaid_mate.audit import audit
+
+    config = flask_server
+    account_data = create_account_with_balance(300)
+    payment_data = {
+        'superuserpassword': config['DEFAULT']['superuser-password'],
+        'account_code': account_data['code'],
+        'drink_barcode': '4029764001807',
+    }
+    req = requests.post('{}/payment/perform'.format(pytest.API_URL), data=payment_data)
+    assert req.status_code == 200
+
+    database = sqlite3.connect(config['DEFAULT']['database'])
+    assert audit(database) == []
+    assert database.execute('SELECT paid, added FROM ledger').fetchall() == [(100, 300)]
+
+    req = requests.post('{}/payment/perform'.format(pytest.API_URL), data=payment_data)
+    assert req.status_code == 200
+    assert audit(database) == []
+    assert database.execute('SELECT paid, added FROM ledger').fetchall() == [(200, 300)]
+
+    account_id, = database.execute('SELECT id FROM accounts').fetchone()
+    database.execute('UPDATE accounts SET saldo=saldo+50')
+    database.commit()
+    assert audit(database) == [(account_id, account_data['name'], 150, 100)]
+    database.close()
@@ -0,0 +1,53 @@
+"""Tests decoding scanner input events into codes."""
+import logging
+
+def key_events(keys, sec=100):
+    """Returns key down and up events for the given key names, e.g. "KEY_1"."""
+    from evdev import InputEvent, ecodes
+
+    events = []
+    for usec, key in enumerate(keys):
+        code = getattr(ecodes, key)
+        events.append(InputEvent(sec, usec, ecodes.EV_KEY, code, 1))  # pylint: disable=no-member
+        events.append(InputEvent(sec, usec, ecodes.EV_KEY, code, 0))  # pylint: disable=no-member
+    return events
+
+def test_decoder_codes():
+    """Test if codes are finished by ENTER and carry the time of the ENTER event."""
+    from evdev import InputEvent, ecodes
+    from prepaid_mate.scanner_client import CodeDecoder
+
+    decoder = CodeDecoder(logging.getLogger())
+    events = key_events(['KEY_4', 'KEY_2', 'KEY_ENTER', 'KEY_0', 'KEY_7', 'KEY_ENTER'])
+    # synchronization events between the key events are skipped
+    sync = InputEvent(100, 0, ecodes.EV_SYN, ecodes.SYN_REPORT, 0)  # pylint: disable=no-member
+    events.insert(1, sync)
+
+    assert list(decoder.feed(events)) == [('42', 100.000002), ('07', 100.000005)]
+
+def test_decoder_split_reads():
+    """Test if a code split across several reads is decoded as a whole."""
+    from prepaid_mate.scanner_client import CodeDecoder
+
+    decoder = CodeDecoder(logging.getLogger())
+    assert not list(decoder.feed(key_events(['KEY_1', 'KEY_2'])))
+    assert not list(decoder.feed(key_events(['KEY_3'])))
+    assert [code for code, _ in decoder.feed(key_events(['KEY_4', 'KEY_ENTER']))] == ['1234']
+
+def test_decoder_shift(caplog):
+    """Test if shift keys sent by some scanners are ignored silently."""
+    from prepaid_mate.scanner_client import CodeDecoder
+
+    decoder = CodeDecoder(logging.getLogger())
+    events = key_events(['KEY_LEFTSHIFT', 'KEY_1', 'KEY_RIGHTSHIFT', 'KEY_2', 'KEY_ENTER'])
+    assert [code for code, _ in decoder.feed(events)] == ['12']
+    assert not caplog.records
+
+def test_decoder_unknown_keys(caplog):
+    """Test if unknown keys are logged and skipped without breaking the code."""
+    from prepaid_mate.scanner_client import CodeDecoder
+
+    decoder = CodeDecoder(logging.getLogger())
+    events = key_events(['KEY_1', 'KEY_A', 'KEY_2', 'KEY_ENTER'])
+    assert [code for code, _ in decoder.feed(events)] == ['12']
+    assert [record.getMessage() for record in caplog.records] == ['got unexpected KEY_A']
@@ -104,3 +104,25 @@ def test_drink_view_inexistent_drink(flask_server, create_drink):
     req = requests.post('{}/drink/view'.format(API_URL), data=data)
     assert req.content == b'No such drink in database'
     assert req.status_code == 400
+
+def test_drink_view_changed_by_other_connection(flask_server, create_drink):
+    """Test if drink view notices drinks changed outside of the server."""
+    import json
+    import sqlite3
+    import requests
+
+    config = flask_server
+    data = create_drink
+    post_data = {'barcode': data['barcode']}
+
+    req = requests.post('{}/drink/view'.format(API_URL), data=post_data)
+    assert json.loads(req.content.decode('utf-8'))[2] == data['price']
+
+    database = sqlite3.connect(config['DEFAULT']['database'])
+    database.execute('UPDATE drinks SET price=? WHERE barcode=?', [250, data['barcode']])
+    database.commit()
+    database.close()
+
+    req = requests.post('{}/drink/view'.format(API_URL), data=post_data)
+    req.raise_for_status()
+    assert json.loads(req.content.decode('utf-8'))[2] == 250
@@ -0,0 +1,74 @@
+"""Tests the scanner client audio and speech feedback."""
+import threading
+
+def blocking_feedback():
+    """
+    Returns (feedback, calls, release). The feedback thread records its
+    commands in the calls list and blocks in the first one until release is
+    set, so items can be queued while audio is "playing".
+    """
+    from prepaid_mate.feedback import Feedback
+
+    feedback = Feedback('speak {msg}', 'play {wav}')
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def _call(cmd):
+        calls.append(cmd)
+        started.set()
+        release.wait(5)
+
+    feedback._call = _call  # pylint: disable=protected-access
+    feedback.play('greeting.wav')
+    assert started.wait(5)
+    return feedback, calls, release
+
+def test_feedback_status_first():
+    """Test if status sounds are played before speech queued earlier."""
+    feedback, calls, release = blocking_feedback()
+    feedback.speak('hello')
+    feedback.play('other_greeting.wav')
+    feedback.play_status('payment_success.wav')
+
+    release.set()
+    feedback.join()
+    assert calls == ['play greeting.wav', 'play payment_success.wav', 'speak hello',
+                     'play other_greeting.wav']
+
+def test_feedback_merge_speech():
+    """Test if speech messages queued while audio plays are merged into one call."""
+    feedback, calls, release = blocking_feedback()
+    feedback.speak('one')
+    feedback.speak('two')
+    feedback.speak('three')
+
+    release.set()
+    feedback.join()
+    assert calls == ['play greeting.wav', 'speak one. two. three']
+
+def test_feedback_drain():
+    """Test if join() returns once all queued feedback was given."""
+    feedback, calls, release = blocking_feedback()
+    for index in range(5):
+        feedback.play_status('{}.wav'.format(index))
+        feedback.speak('message {}'.format(index))
+
+    release.set()
+    feedback.join()
+    assert calls == ['play greeting.wav'] + ['play {}.wav'.format(index) for index in range(5)] \
+        + ['speak {}'.format('. '.join('message {}'.format(index) for index in range(5)))]
+    # nothing left for the next scan
+    assert feedback._queue.empty()  # pylint: disable=protected-access
+
+def test_feedback_speak_disabled():
+    """Test if speech is skipped when disabled while sounds are still played."""
+    from prepaid_mate.feedback import Feedback
+
+    feedback = Feedback('speak {msg}', 'play {wav}', speak=False)
+    calls = []
+    feedback._call = calls.append  # pylint: disable=protected-access
+    feedback.speak('hello')
+    feedback.play_status('payment_failed.wav')
+    feedback.join()
+    assert calls == ['play payment_failed.wav']
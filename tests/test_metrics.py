@@ -0,0 +1,81 @@
+"""Tests request and SQL instrumentation."""
+# disable unused arguments used to run fixtures
+# pylint: disable=unused-argument
+import pytest
+
+API_URL = pytest.API_URL  # pylint: disable=no-member
+
+def test_metrics_histogram():
+    """Test if observations are rendered as cumulative Prometheus histograms."""
+    from prepaid_mate.metrics import Metrics
+
+    metrics = Metrics(buckets=(0.1, 1))
+    metrics.observe('foo_seconds', 0.05, route='/a"b')
+    metrics.observe('foo_seconds', 0.5, route='/a"b')
+    metrics.observe('foo_seconds', 5, route='/a"b')
+
+    assert metrics.render().splitlines() == [
+        '# HELP foo_seconds foo_seconds',
+        '# TYPE foo_seconds histogram',
+        'foo_seconds_bucket{route="/a\\"b",le="0.1"} 1',
+        'foo_seconds_bucket{route="/a\\"b",le="1"} 2',
+        'foo_seconds_bucket{route="/a\\"b",le="+Inf"} 3',
+        'foo_seconds_sum{route="/a\\"b"} 5.55',
+        'foo_seconds_count{route="/a\\"b"} 3',
+    ]
+
+def test_metrics_disabled(flask_server):
+    """Test if metrics are off by default."""
+    import requests
+
+    req = requests.get('{}/metrics'.format(API_URL))
+    assert req.content == b'Metrics disabled'
+    assert req.status_code == 404
+
+@pytest.mark.parametrize('flask_server', [{'metrics': '1'}], indirect=True)
+def test_metrics_endpoint(flask_server, create_account):
+    """Test if requests, statements and password checks are timed."""
+    import requests
+
+    data = create_account
+    req = requests.post('{}/account/view'.format(API_URL), data=data)
+    assert req.status_code == 200
+
+    req = requests.get('{}/metrics'.format(API_URL))
+    assert req.status_code == 200
+    lines = req.content.decode('utf-8').splitlines()
+    assert 'prepaid_mate_request_duration_seconds_count' \
+        '{method="POST",route="/api/account/view",status="200"} 1' in lines
+    assert 'prepaid_mate_password_hash_duration_seconds_count 1' in lines
+    assert any(line.startswith('prepaid_mate_sql_duration_seconds_count{statement="SELECT '
+                               'name, barcode, saldo FROM accounts WHERE id=?"}')
+               for line in lines)
+
+def test_slow_query_log(tmp_path, caplog):
+    """Test if slow statements are logged with their plan, once per fingerprint."""
+    import logging
+    import sqlite3
+    from prepaid_mate.slowlog import SlowQueryLog, fingerprint
+
+    database = sqlite3.connect(str(tmp_path / 'slow.sqlite'))
+    database.execute('CREATE TABLE foo (bar INTEGER)')
+
+    def query_db(query, args=(), one=False):
+        return database.execute(query, args).fetchall()
+
+    # threshold 0 logs every statement
+    query = SlowQueryLog(0).wrap(query_db, lambda: database)
+    with caplog.at_level(logging.WARNING):
+        for _ in range(4):
+            assert query('SELECT bar FROM foo WHERE bar=? OR bar=?', [1, 'secret']) == []
+
+    messages = [record.getMessage() for record in caplog.records]
+    assert len(messages) == 3
+    # only the types of the parameters, they may contain password hashes
+    assert 'parameters: (int, str)' in messages[0]
+    assert 'secret' not in messages[0]
+    assert 'SCAN foo' in messages[0]
+    assert messages[1].startswith('slow query seen 2 times')
+    assert messages[2].startswith('slow query seen 4 times')
+
+    assert fingerprint("SELECT  1,\n 'a''b' FROM foo_2") == 'SELECT ?, ? FROM foo_2'
@@ -209,3 +209,135 @@ def test_money_view_empty(flask_server, create_account):
         req = requests.post('{}/money/view'.format(API_URL), data=data_tmp)
         assert req.content in (b'No such account in database', b'Wrong password')
         assert req.status_code == 400
+
+def test_money_view_paginated(flask_server, create_account_with_balance):
+    """Test if paginated money view returns all transactions page by page."""
+    import copy
+    import json
+    import requests
+
+    config = flask_server
+    data = copy.copy(create_account_with_balance(1000))
+    payment_data = {
+        'superuserpassword': config['DEFAULT']['superuser-password'],
+        'account_code': data['code'],
+        'drink_barcode': '4029764001807'
+    }
+    for _ in range(4):
+        req = requests.post('{}/payment/perform'.format(API_URL), data=payment_data)
+        assert req.status_code == 200
+
+    view_data = {'name': data['name'], 'password': data['password']}
+    req = requests.post('{}/money/view'.format(API_URL), data=view_data)
+    assert req.status_code == 200
+    full_history = json.loads(req.content.decode('utf-8'))
+
+    view_data['limit'] = 2
+    pages = []
+    while True:
+        req = requests.post('{}/money/view'.format(API_URL), data=view_data)
+        assert req.status_code == 200
+        page = json.loads(req.content.decode('utf-8'))
+        assert len(page['transactions']) <= 2
+        pages.extend(page['transactions'])
+        if page['next'] is None:
+            break
+        view_data['before'] = page['next']
+
+    assert len(pages) == 5
+    assert pages[-1][:2] == [1000, 'Guthaben aufgeladen']
+    assert sorted(pages) == sorted(full_history)
+    assert [row[2] for row in pages] == sorted((row[2] for row in pages), reverse=True)
+
+def test_money_view_paginated_invalid(flask_server, create_account):
+    """Test if paginated money view with invalid parameters fails as expected."""
+    import copy
+    import requests
+
+    data = create_account
+    for limit, before, error in (('a', '', b'limit must be integer'),
+                                 ('0', '', b'limit must be between 1 and 500'),
+                                 ('10', 'foo', b'Invalid cursor')):
+        data_tmp = copy.copy(data)
+        data_tmp['limit'] = limit
+        data_tmp['before'] = before
+
+        req = requests.post('{}/money/view'.format(API_URL), data=data_tmp)
+        assert req.content == error
+        assert req.status_code == 400
+
+def test_money_export(flask_server, create_account_with_balance):
+    """Test if transactions are exported as NDJSON and CSV."""
+    import csv
+    import json
+    import requests
+
+    config = flask_server
+    data = create_account_with_balance(1000)
+    superuser_pw = config['DEFAULT']['superuser-password']
+    payment_data = {
+        'superuserpassword': superuser_pw,
+        'account_code': data['code'],
+        'drink_barcode': '4029764001807'
+    }
+    req = requests.post('{}/payment/perform'.format(API_URL), data=payment_data)
+    assert req.status_code == 200
+
+    export_data = {'superuserpassword': superuser_pw, 'account_code': data['code']}
+    req = requests.post('{}/money/export'.format(API_URL), data=export_data)
+    assert req.status_code == 200
+    rows = [json.loads(line) for line in req.content.decode('utf-8').splitlines()]
+    assert [(row['log'], row['account_name'], row['amount']) for row in rows] == \
+        [('pay', 'foo', -100), ('money', 'foo', 1000)]
+    assert rows[0]['drink_barcode'] == '4029764001807'
+
+    export_data['format'] = 'csv'
+    export_data['until'] = rows[0]['timestamp'] - 1
+    req = requests.post('{}/money/export'.format(API_URL), data=export_data)
+    assert req.status_code == 200
+    assert list(csv.reader(req.content.decode('utf-8').splitlines())) == \
+        [['log', 'id', 'timestamp', 'account_id', 'account_name', 'amount', 'drink_barcode',
+          'drink_name']]
+
+def test_money_export_invalid(flask_server):
+    """Test if exports with wrong password or parameters fail as expected."""
+    import requests
+
+    config = flask_server
+    superuser_pw = config['DEFAULT']['superuser-password']
+    for export_data, error in (({'superuserpassword': 'wrongpw'}, b'Wrong superuserpassword'),
+                               ({'format': 'xml'}, b'format must be one of csv, ndjson'),
+                               ({'since': 'yesterday'}, b'since and until must be integer'),
+                               ({'account_code': '123'}, b'No such account in database')):
+        export_data.setdefault('superuserpassword', superuser_pw)
+        req = requests.post('{}/money/export'.format(API_URL), data=export_data)
+        assert req.content == error
+        assert req.status_code == 400
+
+def test_money_add_superuser_backoff(flask_server, create_account):
+    """Test if repeated wrong superuser passwords lock the client out for a while."""
+    import time
+    import requests
+
+    config = flask_server
+    data = create_account
+    data_add = {
+        'superuserpassword': 'wrongpw',
+        'account_code': data['code'],
+        'money': 1000,
+    }
+
+    for _ in range(4):
+        req = requests.post('{}/money/add'.format(API_URL), data=data_add)
+        assert req.content == b'Wrong superuserpassword'
+        assert req.status_code == 400
+
+    data_add['superuserpassword'] = config['DEFAULT']['superuser-password']
+    req = requests.post('{}/money/add'.format(API_URL), data=data_add)
+    assert req.content == b'Too many failed attempts, try again later'
+    assert req.status_code == 400
+
+    time.sleep(1.1)
+    req = requests.post('{}/money/add'.format(API_URL), data=data_add)
+    assert req.content == b'1000'
+    assert req.status_code == 200
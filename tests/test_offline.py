@@ -0,0 +1,109 @@
+"""Tests the scanner client offline journal and its replay."""
+# disable unused arguments used to run fixtures
+# pylint: disable=unused-argument
+
+import pytest
+
+def create_journal(path):
+    """Returns an OfflineJournal at path with a snapshot of one account and drink."""
+    from prepaid_mate.offline import OfflineJournal
+
+    journal = OfflineJournal(str(path))
+    journal.update_snapshot([('0016027465', 'foo', 250)], [('42254300', 'Mate', 100)])
+    return journal
+
+def test_offline_journal_record(tmp_path):
+    """Test if offline payments are checked against the snapshot and pending ones."""
+    journal = create_journal(tmp_path / 'offline.sqlite')
+
+    assert journal.resolve('0016027465') == ('account', 'foo', 250)
+    assert journal.resolve('42254300') == ('drink', 'Mate', 100)
+    assert journal.resolve('1') == ('unknown', None, None)
+
+    assert journal.record('0016027465', '42254300', 'key-1') == 150
+    assert journal.record('0016027465', '42254300', 'key-2') == 50
+    assert journal.resolve('0016027465') == ('account', 'foo', 50)
+
+    for account_code, drink_barcode, error in (
+            ('0016027465', '42254300', 'Insufficient funds'),
+            ('1', '42254300', 'Barcode does not belong to an account'),
+            ('0016027465', '1', 'No such drink in database')):
+        with pytest.raises(ValueError, match=error):
+            journal.record(account_code, drink_barcode, 'key-3')
+
+    assert [payment[:3] for payment in journal.pending()] == [
+        ('key-1', '0016027465', '42254300'), ('key-2', '0016027465', '42254300')]
+
+    # replayed payments are gone, refused ones kept but no longer pending
+    journal.done('key-1')
+    journal.failed('key-2', 'Insufficient funds')
+    assert not journal.pending()
+    assert journal.resolve('0016027465') == ('account', 'foo', 250)
+
+def test_offline_journal_duplicate(tmp_path):
+    """Test if recording the same idempotency key twice keeps one payment."""
+    journal = create_journal(tmp_path / 'offline.sqlite')
+
+    journal.record('0016027465', '42254300', 'key-1')
+    journal.record('0016027465', '42254300', 'key-1')
+    assert [payment[0] for payment in journal.pending()] == ['key-1']
+    assert journal.resolve('0016027465') == ('account', 'foo', 150)
+
+    # the journal survives a restart of the scanner client
+    journal.database.close()
+    journal = create_journal(tmp_path / 'offline.sqlite')
+    assert [payment[0] for payment in journal.pending()] == ['key-1']
+
+def test_offline_replay(flask_server, create_account_with_balance, create_drink, tmp_path):
+    """
+    Test if payments made while the API is unreachable are replayed once it is
+    reachable again, and if replaying the same payment twice charges once.
+    """
+    import json
+    from configparser import ConfigParser
+    import requests
+    from prepaid_mate.scanner_client import ScannerClient
+
+    data = create_account_with_balance(300)
+    drink = create_drink
+
+    config = ConfigParser()
+    config.read_dict(flask_server)
+    config.set('scanner-client', 'offline-journal', str(tmp_path / 'offline.sqlite'))
+    config.set('scanner-client', 'play-call', 'true')
+    config_path = str(tmp_path / 'config')
+    with open(config_path, 'w') as config_file:
+        config.write(config_file)
+
+    client = ScannerClient(config_path)
+    api_url = client.api_url
+
+    def saldo():
+        req = requests.post('{}/account/view'.format(pytest.API_URL), data=data)
+        return json.loads(req.content.decode('utf-8'))[2]
+
+    # online: fetch the snapshot
+    client.sync_offline()
+    assert client.journal.resolve(data['code']) == ('account', data['name'], 300)
+
+    # offline: the payment is journaled
+    client.api_url = 'http://localhost:1'
+    client.account_code = data['code']
+    client.process_barcode_order(drink['barcode'])
+    pending = client.journal.pending()
+    assert len(pending) == 1
+    assert saldo() == 300
+
+    # reconnected: the payment is replayed and the snapshot refreshed
+    client.api_url = api_url
+    client.sync_offline()
+    assert not client.journal.pending()
+    assert saldo() == 200
+    assert client.journal.resolve(data['code']) == ('account', data['name'], 200)
+
+    # the response got lost, the same payment is replayed again
+    key, account_code, drink_barcode, _ = pending[0]
+    client.journal.record(account_code, drink_barcode, key)
+    client.sync_offline()
+    assert not client.journal.pending()
+    assert saldo() == 200
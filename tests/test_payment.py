@@ -79,3 +79,261 @@ def test_payment_perform_insufficient_funds(flask_server, create_account_with_ba
     assert req.status_code == 200
     account_balance = json.loads(req.content.decode('utf-8'))[2]
     assert account_balance == 0
+
+def test_payment_perform_unknown_drink(flask_server, create_account_with_balance):
+    """Test if payment of an inexistent drink fails without touching the balance."""
+    import json
+    import requests
+
+    config = flask_server
+    account_data = create_account_with_balance(100)
+    payment_data = {
+        'superuserpassword': config['DEFAULT']['superuser-password'],
+        'account_code': account_data['code'],
+        'drink_barcode': '123'
+    }
+
+    req = requests.post('{}/payment/perform'.format(API_URL), data=payment_data)
+    assert req.content == b'No such drink in database'
+    assert req.status_code == 400
+
+    req = requests.post('{}/money/view'.format(API_URL), data=account_data)
+    assert req.status_code == 200
+    assert len(json.loads(req.content.decode('utf-8'))) == 1
+
+def test_payment_perform_unknown_account(flask_server):
+    """Test if payment for an inexistent account fails as expected."""
+    import requests
+
+    config = flask_server
+    payment_data = {
+        'superuserpassword': config['DEFAULT']['superuser-password'],
+        'account_code': '123',
+        'drink_barcode': '4029764001807'
+    }
+
+    req = requests.post('{}/payment/perform'.format(API_URL), data=payment_data)
+    assert req.content == b'Barcode does not belong to an account'
+    assert req.status_code == 400
+
+def test_payment_perform_idempotency_key(flask_server, create_account_with_balance):
+    """Test if payments are logged at the given time and keys cannot be reused."""
+    import json
+    import requests
+
+    config = flask_server
+    account_data = create_account_with_balance(300)
+    payment_data = {
+        'superuserpassword': config['DEFAULT']['superuser-password'],
+        'account_code': account_data['code'],
+        'drink_barcode': '4029764001807',
+        'timestamp': 1500000000,
+        'idempotency_key': 'kiosk-1',
+    }
+
+    req = requests.post('{}/payment/perform'.format(API_URL), data=payment_data)
+    assert req.content == b'200'
+    assert req.status_code == 200
+
+    req = requests.post('{}/payment/perform'.format(API_URL), data=payment_data)
+    assert req.content == b'idempotency_key already exists'
+    assert req.status_code == 400
+
+    req = requests.post('{}/money/view'.format(API_URL), data=account_data)
+    history = json.loads(req.content.decode('utf-8'))
+    assert [row[0] for row in history] == [300, -100]
+    assert history[-1][2] == 1500000000
+
+    req = requests.post('{}/account/view'.format(API_URL), data=account_data)
+    assert json.loads(req.content.decode('utf-8'))[2] == 200
+
+def test_snapshot(flask_server, create_account_with_balance, create_drink):
+    """Test if the snapshot contains accounts and drinks."""
+    import json
+    import requests
+
+    config = flask_server
+    account_data = create_account_with_balance(300)
+    drink = create_drink
+
+    req = requests.post('{}/snapshot'.format(API_URL),
+                        data={'superuserpassword': config['DEFAULT']['superuser-password']})
+    assert req.status_code == 200
+    snapshot = json.loads(req.content.decode('utf-8'))
+    assert snapshot['accounts'] == [[account_data['code'], account_data['name'], 300]]
+    assert [drink['barcode'], drink['name'], drink['price']] in snapshot['drinks']
+
+    req = requests.post('{}/snapshot'.format(API_URL), data={'superuserpassword': 'foo'})
+    assert req.content == b'Wrong superuserpassword'
+    assert req.status_code == 400
+
+def test_payment_batch(flask_server, create_account_with_balance):
+    """Test if a batch is applied with per payment results."""
+    import json
+    import requests
+
+    config = flask_server
+    account_data = create_account_with_balance(300)
+    payments = [
+        {'account_code': account_data['code'], 'drink_barcode': '4029764001807',
+         'timestamp': 1500000000, 'idempotency_key': 'kiosk-1'},
+        {'account_code': account_data['code'], 'drink_barcode': '4029764001807',
+         'timestamp': 1500000001, 'idempotency_key': 'kiosk-1'},
+        {'account_code': '123', 'drink_barcode': '4029764001807',
+         'idempotency_key': 'kiosk-2'},
+        {'account_code': account_data['code'], 'drink_barcode': '4029764001807',
+         'idempotency_key': 'kiosk-3'},
+    ]
+    batch_data = {
+        'superuserpassword': config['DEFAULT']['superuser-password'],
+        'payments': json.dumps(payments),
+    }
+
+    req = requests.post('{}/payment/batch'.format(API_URL), data=batch_data)
+    assert req.status_code == 200
+    assert json.loads(req.content.decode('utf-8')) == [
+        {'idempotency_key': 'kiosk-1', 'saldo': 200},
+        {'idempotency_key': 'kiosk-1', 'error': 'idempotency_key already exists'},
+        {'idempotency_key': 'kiosk-2', 'error': 'Barcode does not belong to an account'},
+        {'idempotency_key': 'kiosk-3', 'saldo': 100},
+    ]
+
+    req = requests.post('{}/account/view'.format(API_URL), data=account_data)
+    assert json.loads(req.content.decode('utf-8'))[2] == 100
+
+    batch_data['payments'] = json.dumps([{'account_code': account_data['code']}])
+    req = requests.post('{}/payment/batch'.format(API_URL), data=batch_data)
+    assert req.content == b'Incomplete payment'
+    assert req.status_code == 400
+
+    for idempotency_key in ({'foo': 'bar'}, ['kiosk-4'], 4, '', 'k' * 129):
+        batch_data['payments'] = json.dumps([
+            {'account_code': account_data['code'], 'drink_barcode': '4029764001807',
+             'idempotency_key': idempotency_key}])
+        req = requests.post('{}/payment/batch'.format(API_URL), data=batch_data)
+        assert req.content == \
+            b'idempotency_key must be a non-empty string of at most 128 characters'
+        assert req.status_code == 400
+
+def test_payment_price_change(flask_server, create_account_with_balance, create_drink):
+    """Test if a price change does not rewrite past transactions."""
+    import json
+    import sqlite3
+    import requests
+
+    config = flask_server
+    account_data = create_account_with_balance(300)
+    drink = create_drink
+    payment_data = {
+        'superuserpassword': config['DEFAULT']['superuser-password'],
+        'account_code': account_data['code'],
+        'drink_barcode': drink['barcode'],
+    }
+    req = requests.post('{}/payment/perform'.format(API_URL), data=payment_data)
+    assert req.status_code == 200
+
+    database = sqlite3.connect(config['DEFAULT']['database'])
+    price_history = ('SELECT drink_prices.price FROM drink_prices '
+                     'JOIN drinks ON drinks.id=drink_id WHERE barcode=? ORDER BY drink_prices.id')
+    assert database.execute(price_history, [drink['barcode']]).fetchall() == [(100,)]
+    # manual edits are recorded in the price history as well
+    database.execute('UPDATE drinks SET price=250 WHERE barcode=?', [drink['barcode']])
+    database.commit()
+    assert database.execute(price_history, [drink['barcode']]).fetchall() == [(100,), (250,)]
+    database.close()
+
+    req = requests.post('{}/money/view'.format(API_URL), data=account_data)
+    history = json.loads(req.content.decode('utf-8'))
+    assert sorted(row[:2] for row in history) == [[-100, drink['name']],
+                                                  [300, 'Guthaben aufgeladen']]
+
+def test_payment_historical_price(flask_server, create_account_with_balance):
+    """Test if price changes are recorded and replayed sales use the price of their time."""
+    import json
+    import sqlite3
+    import time
+    import requests
+
+    config = flask_server
+    account_data = create_account_with_balance(500)
+    password = config['DEFAULT']['superuser-password']
+    barcode = '4029764001807'
+
+    drink_data = {'superuserpassword': password, 'barcode': barcode, 'new_price': 150}
+    req = requests.post('{}/drink/modify'.format(API_URL), data=drink_data)
+    assert req.content == b'ok'
+    assert req.status_code == 200
+
+    req = requests.post('{}/drink/view'.format(API_URL), data={'barcode': barcode})
+    assert json.loads(req.content.decode('utf-8'))[2] == 150
+
+    database = sqlite3.connect(config['DEFAULT']['database'])
+    history = database.execute(
+        'SELECT drink_prices.price, drink_prices.timestamp FROM drink_prices '
+        'JOIN drinks ON drinks.id=drink_id WHERE barcode=? ORDER BY drink_prices.id',
+        [barcode]).fetchall()
+    database.close()
+    assert [price for price, _ in history] == [100, 150]
+    assert abs(history[-1][1] - time.time()) < 10
+
+    # a sale recorded offline before the price change and one made now
+    payments = [{'account_code': account_data['code'], 'drink_barcode': barcode,
+                 'timestamp': 1500000000, 'idempotency_key': 'kiosk-1'},
+                {'account_code': account_data['code'], 'drink_barcode': barcode}]
+    batch_data = {'superuserpassword': password, 'payments': json.dumps(payments)}
+    req = requests.post('{}/payment/batch'.format(API_URL), data=batch_data)
+    assert [result['saldo'] for result in json.loads(req.content.decode('utf-8'))] == [400, 250]
+
+    for data, error in (({'barcode': '1', 'new_price': 150}, b'No such drink in database'),
+                        ({'barcode': barcode, 'new_price': 'a'}, b'price must be integer'),
+                        ({'barcode': barcode, 'new_price': 0}, b'price must be positive'),
+                        ({'barcode': barcode, 'new_price': -100}, b'price must be positive'),
+                        ({'barcode': barcode}, b'Incomplete request')):
+        data['superuserpassword'] = password
+        req = requests.post('{}/drink/modify'.format(API_URL), data=data)
+        assert req.content == error
+        assert req.status_code == 400
+
+    # another worker holds the write lock longer than busy-timeout
+    database = sqlite3.connect(config['DEFAULT']['database'])
+    database.execute('BEGIN IMMEDIATE')
+    req = requests.post('{}/drink/modify'.format(API_URL), data=drink_data)
+    database.rollback()
+    database.close()
+    assert req.content == b'database is locked'
+    assert req.status_code == 400
+
+def test_stats(flask_server, create_account_with_balance):
+    """Test if sales show up in the statistics and consumers have to opt in."""
+    import json
+    import time
+    import requests
+
+    config = flask_server
+    account_data = create_account_with_balance(300)
+    payment_data = {
+        'superuserpassword': config['DEFAULT']['superuser-password'],
+        'account_code': account_data['code'],
+        'drink_barcode': '4029764001807',
+    }
+    for _ in range(2):
+        req = requests.post('{}/payment/perform'.format(API_URL), data=payment_data)
+        assert req.status_code == 200
+
+    req = requests.get('{}/stats'.format(API_URL))
+    assert req.status_code == 200
+    stats = json.loads(req.content.decode('utf-8'))
+    assert stats['days'] == [[int(time.time()) // 86400 * 86400, 2, 200]]
+    assert [drink[0::2] for drink in stats['drinks']] == [['4029764001807', 2]]
+    assert stats['consumers'] == []
+
+    modify_data = dict(account_data, stats_opt_in='1')
+    req = requests.post('{}/account/modify'.format(API_URL), data=modify_data)
+    assert req.status_code == 200
+
+    req = requests.get('{}/stats'.format(API_URL))
+    assert json.loads(req.content.decode('utf-8'))['consumers'] == [[account_data['name'], 2]]
+
+    req = requests.get('{}/stats'.format(API_URL), params={'days': 0})
+    assert req.content == b'days must be between 1 and 366'
+    assert req.status_code == 400
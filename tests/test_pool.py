@@ -0,0 +1,36 @@
+"""Tests the SQLite connection pool."""
+
+def test_pool_reuse_and_recycle(tmp_path):
+    """Test if connections are reused and recycled after max_uses or errors."""
+    from prepaid_mate.pool import ConnectionPool
+
+    pool = ConnectionPool(str(tmp_path / 'pool.sqlite'), max_uses=2)
+
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    pool.release(first)
+
+    # max_uses reached
+    second = pool.acquire()
+    assert second is not first
+    second.execute('CREATE TABLE foo (bar INTEGER)')
+    second.execute('INSERT INTO foo VALUES (1)')
+    pool.release(second)
+    # uncommitted transaction was rolled back
+    assert second.execute('SELECT count(*) FROM foo').fetchone()[0] == 0
+
+    pool.release(pool.acquire(), error=True)
+    assert pool.acquire() is not second
+
+def test_pool_on_connect(tmp_path):
+    """Test if the on_connect hook is called once per connection."""
+    from prepaid_mate.pool import ConnectionPool
+
+    connected = []
+    pool = ConnectionPool(str(tmp_path / 'pool.sqlite'), on_connect=connected.append)
+
+    for _ in range(3):
+        pool.release(pool.acquire())
+
+    assert len(connected) == 1
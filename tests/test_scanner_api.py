@@ -0,0 +1,95 @@
+"""Tests the API calls of the scanner client with a mocked HTTP session."""
+from unittest import mock
+
+import pytest
+import requests
+
+def create_client(tmp_path, **options):
+    """
+    Returns a ScannerClient using config.sample with the given scanner-client
+    options and a mocked session. Underscores in keys are replaced with minuses.
+    """
+    from configparser import ConfigParser
+    from prepaid_mate.scanner_client import ScannerClient
+
+    config = ConfigParser()
+    config.read('./config.sample')
+    config.set('scanner-client', 'offline-journal', str(tmp_path / 'offline.sqlite'))
+    config.set('scanner-client', 'play-call', 'true')
+    for key, value in options.items():
+        config.set('scanner-client', key.replace('_', '-'), value)
+
+    config_path = str(tmp_path / 'config')
+    with open(config_path, 'w') as config_file:
+        config.write(config_file)
+
+    client = ScannerClient(config_path)
+    client.session = mock.Mock()
+    return client
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Records the backoff delays instead of sleeping."""
+    delays = []
+    monkeypatch.setattr('prepaid_mate.scanner_client.time.sleep', delays.append)
+    return delays
+
+def test_api_post_timeouts(tmp_path, sleeps):
+    """Test if the configured connect and read timeouts are passed separately."""
+    client = create_client(tmp_path, api_connect_timeout='0.5', api_read_timeout='3')
+    client.session.post.return_value = 'response'
+
+    assert client.api_post('/api/code/resolve', {'code': '1'}, idempotent=True) == 'response'
+    client.session.post.assert_called_once_with('http://localhost:5000/api/code/resolve',
+                                                data={'code': '1'}, timeout=(0.5, 3))
+    assert not sleeps
+
+def test_api_post_not_idempotent(tmp_path, sleeps):
+    """Test if non-idempotent calls are never retried."""
+    client = create_client(tmp_path, api_retries='2')
+
+    for exc in (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout):
+        client.session.post.reset_mock()
+        client.session.post.side_effect = exc
+        with pytest.raises(exc):
+            client.api_post('/api/payment/perform', {})
+        assert client.session.post.call_count == 1
+    assert not sleeps
+
+def test_api_post_retries(tmp_path, sleeps):
+    """Test if idempotent calls are retried with backoff and give up eventually."""
+    client = create_client(tmp_path, api_retries='2')
+    client.session.post.side_effect = requests.exceptions.ConnectTimeout
+
+    with pytest.raises(requests.exceptions.ConnectTimeout):
+        client.api_post('/api/code/resolve', {}, idempotent=True)
+    assert client.session.post.call_count == 3
+    assert sleeps == [0.1, 0.2]
+
+    # succeeds on the last attempt
+    client.session.post.reset_mock()
+    client.session.post.side_effect = [requests.exceptions.ConnectionError,
+                                       requests.exceptions.ReadTimeout, 'response']
+    assert client.api_post('/api/code/resolve', {}, idempotent=True) == 'response'
+    assert client.session.post.call_count == 3
+
+def test_payment_read_timeout(tmp_path, sleeps):
+    """
+    Test if a payment whose response timed out is reported as unknown instead
+    of being journaled, while an unreachable API leads to an offline payment.
+    """
+    from prepaid_mate.scanner_client import BackendError
+
+    client = create_client(tmp_path)
+    client.journal.update_snapshot([('0016027465', 'foo', 250)], [('42254300', 'Mate', 100)])
+    client.account_code = '0016027465'
+
+    client.session.post.side_effect = requests.exceptions.ReadTimeout
+    with pytest.raises(BackendError, match='Payment outcome unknown'):
+        client.process_barcode_order('42254300')
+    assert not client.journal.pending()
+
+    client.session.post.side_effect = requests.exceptions.ConnectTimeout
+    client.process_barcode_order('42254300')
+    assert len(client.journal.pending()) == 1
+    assert client.session.post.call_count == 2
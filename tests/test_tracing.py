@@ -0,0 +1,33 @@
+"""Tests the scanner client latency tracing."""
+
+def test_tracing_summary(tmp_path):
+    """Test if marked stages are written and summarized per segment."""
+    from prepaid_mate.tracing import Tracer, read_spans, summary
+
+    path = str(tmp_path / 'trace.jsonl')
+    tracer = Tracer(path)
+    for offset in (0, 10):
+        span = tracer.span()
+        span.mark('key_enter', offset + 0.000)
+        span.mark('code_decoded', offset + 0.001)
+        span.mark('processing_started', offset + 0.003, rfid=False)
+        span.mark('api_response', offset + 0.023, endpoint='/api/code/resolve')
+        span.mark('api_response', offset + 0.050, endpoint='/api/payment/perform')
+        span.mark('feedback_started', offset + 0.123, kind='play')
+        span.mark('feedback_started', offset + 0.500, kind='speak')
+
+    # no feedback, e.g. tracing stopped by a crash
+    tracer.span().mark('key_enter', 20)
+
+    with open(path) as trace_file:
+        spans = read_spans(trace_file)
+
+    assert len(spans) == 3
+    rows = {row[0]: [round(value) for value in row[1:]] for row in summary(spans)}
+    assert rows == {
+        'decode': [2, 1, 1, 1],
+        'queue': [2, 2, 2, 2],
+        'api': [2, 20, 20, 20],
+        'feedback': [2, 100, 100, 100],
+        'total': [2, 123, 123, 123],
+    }